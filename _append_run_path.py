@@ -24,7 +24,7 @@ def _append_run_path():
         # append to system path environment
         os.environ["PATH"] += os.pathsep + os.pathsep.join(pathlist)
 
-    logging.error("current PATH: %s", os.environ['PATH'])
+    logging.debug("current PATH: %s", os.environ['PATH'])
 
 
 _append_run_path()
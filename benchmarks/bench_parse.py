@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+'''
+Compares the original full-document parse against the targeted parse used by
+RibbonScraper, reporting wall time and peak Python memory for each page.
+
+Usage: python benchmarks/bench_parse.py [--usaf FILE] [--afrotc FILE]
+
+Without arguments the pages are generated by fixtures.py; saved copies of the
+real pages can be passed instead.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import base64
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+import fixtures
+from ribbonscraper import RibbonScraper
+
+
+def legacy_usaf(scraper, content):
+    '''
+    Full parse, lambda search and split/b64decode, as originally scraped.
+    '''
+    soup = BeautifulSoup(content, 'lxml')
+    rows = soup.find(lambda tag:
+                     tag.name == 'div' and
+                     tag.has_attr('id') and
+                     tag['id'] == scraper.containers['USAF']).findAll('tr')
+    for row in rows:
+        for image in row.findAll('img'):
+            base64.b64decode(image['src'].split('base64,', 1)[-1])
+
+
+def targeted_usaf(scraper, content):
+    '''
+    Strained parse and memoryview decode, as currently scraped.
+    '''
+    soup = scraper.parse_soup('USAF', content)
+    rows = soup.find('div', id=scraper.containers['USAF']).findAll('tr')
+    for row in rows:
+        for image in row.findAll('img'):
+            scraper.decode_data_uri(image['src'])
+
+
+def legacy_afrotc(scraper, content):
+    '''
+    Full parse and lambda search, as originally scraped.
+    '''
+    soup = BeautifulSoup(content, 'lxml')
+    rows = soup.find(lambda tag:
+                     tag.name == 'div' and
+                     tag.has_attr('id') and
+                     tag['id'] == scraper.containers['AFROTC']
+                     ).table.findAll('tr')
+    return [(row.font.text, row.img['src']) for row in rows[::2]]
+
+
+def targeted_afrotc(scraper, content):
+    '''
+    Strained parse, as currently scraped.
+    '''
+    soup = scraper.parse_soup('AFROTC', content)
+    rows = soup.find(
+        'div', id=scraper.containers['AFROTC']).table.findAll('tr')
+    return [(row.font.text, row.img['src']) for row in rows[::2]]
+
+
+def measure(function, scraper, content, repeat):
+    '''
+    Returns the best wall time over repeat runs and the peak traced memory
+    of a single run.
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(scraper, content)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(scraper, content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    '''
+    Runs both parse paths over both pages and prints a comparison.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--usaf', help="saved AFPC ribbons page")
+    parser.add_argument('--afrotc', help="saved PatriotFiles ribbons post")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = dict(
+        USAF=(open(args.usaf, 'rb').read() if args.usaf
+              else fixtures.usaf_page()),
+        AFROTC=(open(args.afrotc, 'rb').read() if args.afrotc
+                else fixtures.afrotc_page('http://localhost/')))
+    paths = dict(USAF=(legacy_usaf, targeted_usaf),
+                 AFROTC=(legacy_afrotc, targeted_afrotc))
+    scraper = RibbonScraper()
+    print("Pages: USAF " + (args.usaf or "synthetic (fixtures.py)") +
+          ", AFROTC " + (args.afrotc or "synthetic (fixtures.py)"))
+    print("{:<8}{:<10}{:>12}{:>14}".format(
+        "page", "parse", "time (ms)", "peak (KiB)"))
+    for branch, content in pages.items():
+        for label, function in zip(("full", "targeted"), paths[branch]):
+            seconds, peak = measure(function, scraper, content, args.repeat)
+            print("{:<8}{:<10}{:>12.1f}{:>14.0f}".format(
+                branch, label, seconds * 1000, peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+'''
+Times loading and storing precedence through the JSON format and the binary
+store, for synthetic catalogs 1x, 10x and 100x the size of the bundled one.
+
+Usage: python benchmarks/bench_precedence.py [--scales 1 10 100]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import collections
+import copy
+import json
+from pathlib import Path
+import tempfile
+import time
+
+import fixtures
+from ribbons import Ribbons
+
+
+def legacy_load(path):
+    '''
+    The original JSON load: parse, rebuild into defaultdicts, convert every
+    key and deepcopy.
+    '''
+    with path.open('r') as filepath:
+        precedence = json.load(filepath)
+    precedence = collections.defaultdict(dict, precedence)
+    newdict = collections.defaultdict(dict)
+    for branch, ribbons in precedence.items():
+        for rank in ribbons.keys():
+            newdict[branch][int(rank)] = precedence[branch][rank]
+    return copy.deepcopy(newdict)
+
+
+def best_of(function, repeat):
+    '''
+    Returns the best wall time of repeat calls, in milliseconds.
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def ribbons_in(folder):
+    '''
+    A Ribbons object storing everything in folder.
+    '''
+    ribbons = Ribbons()
+    ribbons.info_location = folder.joinpath('precedence.json')
+    ribbons.store_location = folder.joinpath('precedence.bin')
+    return ribbons
+
+
+def bench_scale(scale, repeat):
+    '''
+    Runs every load/store variant for one catalog size.
+    '''
+    folder = Path(tempfile.mkdtemp())
+    source = ribbons_in(folder)
+    for branch, ribbons in fixtures.synthetic_precedence(scale).items():
+        source.precedence[branch] = ribbons
+    source.export_json()
+    source.store_precedence()
+
+    def load_store_all():
+        ribbons = ribbons_in(folder)
+        ribbons.load_precedence()
+        ribbons.precedence.load_all()
+
+    def load_store_one():
+        ribbons = ribbons_in(folder)
+        ribbons.load_precedence()
+        ribbons.precedence['USAF']  # pylint: disable=pointless-statement
+
+    count = sum(len(ribbons) for ribbons in source.precedence.values())
+    return dict(
+        ribbons=count,
+        legacy_json_load=best_of(
+            lambda: legacy_load(source.info_location), repeat),
+        json_import=best_of(lambda: ribbons_in(folder).import_json(), repeat),
+        store_load_all=best_of(load_store_all, repeat),
+        store_load_one_branch=best_of(load_store_one, repeat),
+        json_export=best_of(source.export_json, repeat),
+        store_write=best_of(source.store_precedence, repeat))
+
+
+def main():
+    '''
+    Prints a table of timings (ms) per catalog size.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for scale in args.scales:
+        results = bench_scale(scale, args.repeat)
+        print("{}x ({} ribbons)".format(scale, results.pop('ribbons')))
+        for name, milliseconds in results.items():
+            print("    {:<24}{:>10.3f} ms".format(name, milliseconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''
+Measures application startup: the time to import ribbonrack, and the time
+from process start until the main window first paints, using Qt's offscreen
+platform. Every run is a fresh interpreter with a throwaway home folder
+holding the bundled ribbon data, so runs are reproducible and never scrape.
+
+Usage: python benchmarks/bench_startup.py [--runs 10]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import json
+import os
+from pathlib import Path
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = Path(__file__).resolve().parent.parent
+
+# runs inside the measured interpreter
+CHILD = '''
+import json, sys, time
+START = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import ribbonrack
+IMPORTED = time.perf_counter()
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+
+class FirstPaint(QObject):
+    def __init__(self):
+        super().__init__()
+        self.painted = None
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and self.painted is None:
+            self.painted = time.perf_counter()
+            QTimer.singleShot(0, APP.quit)
+        return False
+
+APP = QApplication(sys.argv[:1])
+FILTER = FirstPaint()
+WINDOW = ribbonrack.MainWindow()
+WINDOW.installEventFilter(FILTER)
+WINDOW.show()
+APP.exec_()
+print(json.dumps(dict(import_ms=(IMPORTED - START) * 1000,
+                      first_paint_ms=(FILTER.painted - START) * 1000)))
+'''
+
+
+def prepare_home():
+    '''
+    Creates a home folder with the bundled data where Ribbons looks for it.
+    '''
+    home = Path(tempfile.mkdtemp())
+    data = home.joinpath('.ribbonrack')
+    shutil.copytree(str(REPO.joinpath('ribbonrack_data')), str(data))
+    return home
+
+
+def run_once(home):
+    '''
+    Starts the application once and returns its timings.
+    '''
+    environment = dict(os.environ, HOME=str(home),
+                       QT_QPA_PLATFORM='offscreen')
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, str(REPO)], env=environment,
+        cwd=str(REPO), check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    '''
+    Runs the application repeatedly and prints median and worst timings.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    home = prepare_home()
+    # first run converts precedence.json into the binary store
+    run_once(home)
+    runs = [run_once(home) for _ in range(args.runs)]
+    for name in ('import_ms', 'first_paint_ms'):
+        values = [run[name] for run in runs]
+        print("{:<16}median {:>8.1f} ms   max {:>8.1f} ms".format(
+            name, statistics.median(values), max(values)))
+    shutil.rmtree(str(home))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+'''
+Builds offline stand-ins for the scraped AFPC and PatriotFiles pages out of
+the bundled ribbon data, so benchmarks never touch the network. The ribbon
+tables mirror the markup the scrapers expect, and are surrounded by filler
+markup to approximate the size of the real pages. Catalogs can be scaled up
+synthetically, and the pages served from a local HTTP server.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import base64
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import re
+import sys
+import threading
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+from ribboncatalog import sanitize_filename  # noqa: E402 pylint: disable=wrong-import-position
+
+DATA = REPO.joinpath('ribbonrack_data')
+
+
+def load_precedence():
+    '''
+    Reads the bundled precedence file, ordered by precedence.
+    '''
+    with DATA.joinpath('precedence.json').open('r') as filepath:
+        precedence = json.load(filepath)
+    return {branch: [ribbons[key] for key in
+                     sorted(ribbons, key=int)]
+            for branch, ribbons in precedence.items()}
+
+
+def synthetic_names(branch, scale):
+    '''
+    Repeats a branch's bundled ribbons scale times, in order of precedence.
+    Copies after the first are named "<name> <copy number>".
+    '''
+    names = load_precedence()[branch]
+    return [name + " " + str(copy_number) if copy_number else name
+            for copy_number in range(scale) for name in names]
+
+
+def synthetic_precedence(scale):
+    '''
+    {branch: {precedence: ribbon name}} with every branch scaled up by
+    synthetic_names().
+    '''
+    return {branch: dict(enumerate(synthetic_names(branch, scale)))
+            for branch in load_precedence()}
+
+
+def image_bytes(branch, name):
+    '''
+    Reads the bundled image for a ribbon, or for the ribbon a synthetic copy
+    was made from.
+    '''
+    filename = sanitize_filename(re.sub(r" \d+$", "", name))
+    return DATA.joinpath('images', branch, filename + '.jpeg').read_bytes()
+
+
+def filler(count):
+    '''
+    Unrelated markup standing in for navigation, scripts, comments etc.
+    '''
+    return ''.join(
+        '<div class="nav"><ul><li><a href="/page/{0}">Link {0}</a></li>'
+        '<li><span>Item {0}</span></li></ul><p>Lorem ipsum dolor sit amet '
+        '{0}</p></div>'.format(index) for index in range(count))
+
+
+def usaf_page(names=None, padding=2000):
+    '''
+    Builds an AFPC-style page, with every ribbon image inlined as base64.
+    '''
+    names = names or load_precedence()['USAF']
+    cells = []
+    for name in names:
+        payload = base64.b64encode(image_bytes('USAF', name)).decode('ascii')
+        cells.append(
+            '<td><img alt="{alt}" src="data:image/jpeg;base64,{payload}"/>'
+            '<a href="#"><span>{name}</span></a></td>'.format(
+                alt=name.upper(), payload=payload, name=name))
+    rows = ''.join('<tr>' + ''.join(cells[index:index + 3]) + '</tr>'
+                   for index in range(0, len(cells), 3))
+    return ('<html><head><title>Decorations</title></head><body>' +
+            filler(padding) +
+            '<div id="dnn_ctr25862_HtmlModule_lblContent"><table>' + rows +
+            '</table></div>' + filler(padding) +
+            '</body></html>').encode('utf-8')
+
+
+def afrotc_page(image_url, names=None, padding=2000):
+    '''
+    Builds a forum-post-style page. Images are linked as
+    image_url + "<filename>.jpeg", e.g. for a local stand-in server.
+    '''
+    names = names or load_precedence()['AFROTC']
+    rows = []
+    for name in names:
+        filename = sanitize_filename(name)
+        rows.append(
+            '<tr><td><img src="{url}{filename}.jpeg"/></td>'
+            '<td><font>{name}</font></td></tr><tr><td>&nbsp;</td></tr>'.format(
+                url=image_url, filename=filename, name=name))
+    return ('<html><head><title>AFROTC Ribbons</title></head><body>' +
+            filler(padding) +
+            '<div id="post_message_445047"><table>' + ''.join(rows) +
+            '</table></div>' + filler(padding) +
+            '</body></html>').encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the server's pages dictionary, {path: bytes}.
+    '''
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''
+        Responds with a page, or a 404.
+        '''
+        content = self.server.pages.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''
+        Requests aren't logged.
+        '''
+
+
+def serve_pages(scale=1, padding=2000):
+    '''
+    Starts a local stand-in for both scraped sites, serving catalogs scaled
+    by synthetic_names() at /usaf, /afrotc and the AFROTC images under
+    /images/. Returns the server, whose urls attribute maps each branch to
+    its page; call shutdown() when done.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    base_url = 'http://127.0.0.1:' + str(server.server_address[1])
+    afrotc = synthetic_names('AFROTC', scale)
+    server.pages = {
+        '/usaf': usaf_page(synthetic_names('USAF', scale), padding),
+        '/afrotc': afrotc_page(base_url + '/images/', afrotc, padding)}
+    for name in afrotc:
+        server.pages['/images/' + sanitize_filename(name) + '.jpeg'] = \
+            image_bytes('AFROTC', name)
+    server.urls = dict(USAF=base_url + '/usaf', AFROTC=base_url + '/afrotc')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
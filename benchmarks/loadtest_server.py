@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''
+Load-tests the rack rendering service. Starts a local instance with a
+throwaway home folder holding the bundled ribbon data (or targets --url),
+sends random rack requests from concurrent clients, and reports latency
+percentiles and throughput.
+
+Usage: python benchmarks/loadtest_server.py [--requests 2000]
+       [--concurrency 16] [--distinct 200] [--url http://host:port]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import fixtures
+
+
+def free_port():
+    '''
+    Returns a port nothing is listening on.
+    '''
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(port, workers):
+    '''
+    Starts a local service on a copy of the bundled data, returning the
+    process and its home folder once it accepts connections.
+    '''
+    home = Path(tempfile.mkdtemp())
+    shutil.copytree(str(fixtures.DATA), str(home.joinpath('.ribbonrack')))
+    command = [sys.executable, str(fixtures.REPO.joinpath('ribbonserver.py')),
+               '--port', str(port)]
+    if workers:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, env=dict(os.environ, HOME=str(home)),
+                               cwd=str(fixtures.REPO))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return process, home
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Service didn't start")
+
+
+def rack_urls(base_url, distinct, seed):
+    '''
+    Builds a pool of distinct random rack requests of 1 to 20 ribbons.
+    '''
+    generator = random.Random(seed)
+    urls = []
+    for branch, names in sorted(fixtures.load_precedence().items()):
+        for _ in range(distinct // 2):
+            ribbons = generator.sample(names, generator.randint(
+                1, min(20, len(names))))
+            urls.append(base_url + '/rack/' + branch + '?' +
+                        urlencode([('ribbon', name) for name in ribbons]))
+    return urls
+
+
+def timed_get(url):
+    '''
+    Fetches a URL, returning the wall time in milliseconds.
+    '''
+    start = time.perf_counter()
+    with urlopen(url) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def percentile(values, fraction):
+    '''
+    Nearest-rank percentile of sorted values.
+    '''
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    '''
+    Runs the load test and prints latency percentiles and throughput.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help="test a running service instead")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--distinct', type=int, default=200,
+                        help="number of different racks requested")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    process = home = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        process, home = start_server(port, args.workers)
+        base_url = 'http://127.0.0.1:' + str(port)
+    try:
+        pool = rack_urls(base_url.rstrip('/'), args.distinct, args.seed)
+        generator = random.Random(args.seed)
+        urls = [generator.choice(pool) for _ in range(args.requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            latencies = sorted(executor.map(timed_get, urls))
+        elapsed = time.perf_counter() - start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(str(home))
+    print("{} requests, {} distinct racks, concurrency {}".format(
+        len(latencies), len(pool), args.concurrency))
+    print("    p50 {:>8.2f} ms".format(percentile(latencies, 0.50)))
+    print("    p99 {:>8.2f} ms".format(percentile(latencies, 0.99)))
+    print("    max {:>8.2f} ms".format(latencies[-1]))
+    print("    {:>8.1f} requests/s".format(len(latencies) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+'''
+Times the application's hot paths offline, for synthetic catalogs 10x and
+100x the size of the bundled one: scraping (against a local stand-in for
+both sites), loading and storing precedence, moving ribbons between the
+selector lists, and adding/removing ribbons in RibbonGridLayout (under Qt's
+offscreen platform). Results are written as JSON, and can be compared with
+an earlier run to catch regressions. The pages and catalogs are synthetic,
+built by fixtures.py from the bundled data rather than recorded from the
+sites, so the results compare runs with each other, not with live scrapes.
+
+Usage: python benchmarks/run_suite.py [--scales 10 100] [-o results.json]
+       [--compare baseline.json [--threshold 0.25]]
+       [--groups scrape precedence selector layout]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import bench_precedence
+import fixtures
+from ribboncatalog import RibbonCatalog
+
+GROUPS = ('scrape', 'precedence', 'selector', 'layout')
+# ribbons per rack in the layout benchmarks, multiplied by the scale
+RACK_SIZE = 10
+# printed with, and stored in, every set of results
+FIXTURES_NOTE = ("synthetic: pages and catalogs generated by fixtures.py, "
+                 "not recorded from the live sites")
+
+
+def best_of(run, repeat, setup=None):
+    '''
+    Returns the best wall time of repeat calls of run, in milliseconds. If
+    given, setup is called untimed before each run and its result passed
+    to run, so runs that change state start from the same state.
+    '''
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            run(argument)
+        else:
+            run()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def ribbons_in(folder):
+    '''
+    A Ribbons object storing everything, images included, in folder.
+    '''
+    ribbons = bench_precedence.ribbons_in(folder)
+    ribbons.image_location = folder.joinpath('images')
+    ribbons.thumbnail_location = ribbons.image_location.joinpath('thumbnails')
+    ribbons.manifest_location = folder.joinpath('manifest.json')
+    return ribbons
+
+
+def bench_scrape(scale, repeat):
+    '''
+    Times fetching and parsing each page, and scraping the parsed page,
+    against the local stand-in sites.
+    '''
+    # imported here so the other groups run without the scraping stack
+    from ribbonmanifest import ScrapeManifest  # pylint: disable=import-outside-toplevel
+    from ribbonscraper import RibbonScraper  # pylint: disable=import-outside-toplevel
+    server = fixtures.serve_pages(scale)
+    folder = Path(tempfile.mkdtemp())
+    results = dict()
+    try:
+        scraper = RibbonScraper()
+        scraper.urls = server.urls
+        for branch, scrape in (('USAF', scraper.scrape_usaf),
+                               ('AFROTC', scraper.scrape_afrotc)):
+            image_folder = folder.joinpath('images', branch)
+            image_folder.mkdir(parents=True)
+
+            def setup():
+                # a fresh manifest, so every image is written again
+                scraper.manifest = ScrapeManifest(
+                    folder.joinpath('manifest.json'))
+                return ribbons_in(folder)
+
+            def fetch(_):
+                scraper.get_soup(branch)  # pylint: disable=cell-var-from-loop
+
+            setup()
+            soup = scraper.get_soup(branch)
+            results['get_soup_' + branch.lower()] = best_of(
+                fetch, repeat, setup)
+            results['scrape_' + branch.lower()] = best_of(
+                lambda ribbons: scrape(ribbons, soup, image_folder),  # pylint: disable=cell-var-from-loop
+                repeat, setup)
+    finally:
+        server.shutdown()
+        shutil.rmtree(str(folder))
+    return results
+
+
+def bench_precedence_group(scale, repeat):
+    '''
+    Times loading and storing precedence, as benchmarks/bench_precedence.py.
+    '''
+    results = bench_precedence.bench_scale(scale, repeat)
+    del results['ribbons']
+    return results
+
+
+def synthetic_catalog(scale):
+    '''
+    A USAF catalog scaled up synthetically. The images don't exist, and
+    aren't needed, since nothing is painted.
+    '''
+    precedence = fixtures.synthetic_precedence(scale)['USAF']
+    return RibbonCatalog('USAF', precedence, tempfile.gettempdir())
+
+
+def bench_selector(scale, repeat):
+    '''
+    Times moving ribbons between the selector lists one at a time, and
+    replacing the selection in bulk.
+    '''
+    from ribbonselector import RibbonSelector  # pylint: disable=import-outside-toplevel
+    catalog = synthetic_catalog(scale)
+    moved = random.Random(scale).sample(
+        [record.ribbon_id for record in catalog], min(len(catalog),
+                                                      RACK_SIZE * scale))
+
+    def select_each(selector):
+        for ribbon_id in moved:
+            selector.select_ribbon(ribbon_id)
+
+    def deselect_each(selector):
+        for ribbon_id in moved:
+            selector.deselect_ribbon(ribbon_id)
+
+    def selected():
+        selector = RibbonSelector(catalog)
+        selector.set_selection(moved)
+        return selector
+
+    return dict(
+        select_each=best_of(select_each, repeat,
+                            lambda: RibbonSelector(catalog)),
+        deselect_each=best_of(deselect_each, repeat, selected),
+        set_selection=best_of(lambda selector: selector.set_selection(moved),
+                              repeat, lambda: RibbonSelector(catalog)))
+
+
+def bench_layout(scale, repeat):
+    '''
+    Times adding and removing ribbons one at a time, in random order, with
+    a rearrange after each, and replacing them all in one bulk operation.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from PyQt5.QtWidgets import QLabel, QWidget
+    from ribbondisplay import RibbonGridLayout
+    catalog = synthetic_catalog(scale)
+    records = random.Random(scale).sample(
+        list(catalog), min(len(catalog), RACK_SIZE * scale))
+
+    def empty():
+        parent = QWidget()
+        layout = RibbonGridLayout(parent)
+        parent.setLayout(layout)
+        # the parent is kept in the state so it isn't garbage collected
+        return parent, layout, [(record, QLabel()) for record in records]
+
+    def full():
+        state = empty()
+        state[1].replace_ribbons([], state[2])
+        return state
+
+    def add_each(state):
+        _, layout, pairs = state
+        for ribbon_pair in pairs:
+            layout.add_ribbon(ribbon_pair)
+            layout.rearrange(ribbon_pair)
+
+    def remove_each(state):
+        _, layout, _ = state
+        for record in records:
+            ribbon_pair, index = layout.remove_ribbon(record)
+            layout.rearrange(ribbon_pair, index)
+
+    def replace_all(state):
+        _, layout, pairs = state
+        layout.replace_ribbons([], pairs)
+
+    return dict(add_each=best_of(add_each, repeat, empty),
+                remove_each=best_of(remove_each, repeat, full),
+                replace_ribbons=best_of(replace_all, repeat, empty))
+
+
+BENCHMARKS = dict(scrape=bench_scrape, precedence=bench_precedence_group,
+                  selector=bench_selector, layout=bench_layout)
+
+
+def run(groups, scales, repeat):
+    '''
+    Runs the benchmark groups at every scale, returning
+    {"<group>.<benchmark>@<scale>x": milliseconds}.
+    '''
+    if 'selector' in groups or 'layout' in groups:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication  # pylint: disable=import-outside-toplevel
+        application = QApplication.instance() or QApplication(sys.argv[:1])  # pylint: disable=unused-variable
+    results = dict()
+    for group in groups:
+        for scale in scales:
+            print("Running " + group + " at " + str(scale) + "x", flush=True)
+            for name, milliseconds in BENCHMARKS[group](scale,
+                                                        repeat).items():
+                results["{}.{}@{}x".format(group, name, scale)] = milliseconds
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints every result against the baseline, and returns the names of the
+    results more than threshold (a fraction) slower than their baseline.
+    '''
+    regressions = []
+    print("{:<40}{:>12}{:>12}{:>9}".format(
+        "benchmark", "base (ms)", "now (ms)", "ratio"))
+    for name, milliseconds in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print("{:<40}{:>12}{:>12.3f}".format(name, "-", milliseconds))
+            continue
+        ratio = milliseconds / base if base else float('inf')
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        print("{:<40}{:>12.3f}{:>12.3f}{:>8.2f}x{}".format(
+            name, base, milliseconds, ratio, flag))
+    return regressions
+
+
+def main():
+    '''
+    Runs the suite, writes the results and compares them to a baseline.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--groups', nargs='+', choices=GROUPS,
+                        default=list(GROUPS))
+    parser.add_argument('-o', '--output', help="write results JSON here")
+    parser.add_argument('--compare', help="results JSON of a baseline run")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a "
+                        "fraction (default 0.25)")
+    args = parser.parse_args()
+    results = run(args.groups, args.scales, args.repeat)
+    report = dict(
+        created=datetime.datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(), platform=platform.platform(),
+        scales=args.scales, repeat=args.repeat, fixtures=FIXTURES_NOTE,
+        results=results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, sort_keys=True, indent=4,
+                      separators=(',', ': '))
+    baseline = dict()
+    if args.compare:
+        with open(args.compare, 'r') as previous:
+            baseline = json.load(previous)['results']
+    print("Fixtures: " + FIXTURES_NOTE)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(str(len(regressions)) + " benchmarks regressed by more than " +
+              "{:.0%}".format(args.threshold))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+'''
+Packs a branch's ribbon images into a single atlas file with a compact binary
+index, so displaying or exporting ribbons reads one file instead of opening
+every image separately.
+
+Usage: python ribbonatlas.py [branch ...]
+
+File layout (little-endian): an 8 byte magic/version/count header, then per
+image its offset and length in the image data, its width and height, and its
+name (the image's filename without extension), then the image data. Index and
+data share one file, so replacing it can never pair an index with the wrong
+data.
+
+The atlas is read into memory whole rather than memory-mapped. A scrape
+repacks it on a worker thread while thumbnail threads may still hold slices
+of the old one, and Windows refuses to replace a mapped file; one read of a
+file this small (about 110 KB for USAF) costs no more than mapping it.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+from pathlib import Path
+import struct
+import sys
+
+from ribbonfiles import atomic_write
+from ribbons import Ribbons
+
+ATLAS_MAGIC = b'RRIX'
+ATLAS_VERSION = 2
+HEADER = struct.Struct('<4sHH')
+ENTRY = struct.Struct('<QIHHH')
+# files packed into an atlas; anything else in the folder, such as a
+# scrape's leftover temporary files, is skipped
+IMAGE_SUFFIXES = ('.jpeg', '.jpg', '.png', '.gif')
+
+
+def atlas_path(image_location, branch):
+    '''
+    Returns the atlas file path for a branch.
+    '''
+    return Path(image_location).joinpath(branch + ".atlas")
+
+
+def image_size(data):
+    '''
+    Reads (width, height) from a JPEG, PNG or GIF header without decoding
+    the image. Returns (0, 0) for anything else.
+    '''
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', data[6:10])
+    if data[:2] == b'\xff\xd8':
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset] != 0xff:
+                offset += 1
+                continue
+            marker = data[offset + 1]
+            if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7:
+                offset += 2
+                continue
+            length, = struct.unpack('>H', data[offset + 2:offset + 4])
+            # start-of-frame markers, excluding DHT, JPG and DAC
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack(
+                    '>HH', data[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + length
+    return 0, 0
+
+
+def build_atlas(image_location, branch):
+    '''
+    Packs every image (by IMAGE_SUFFIXES) in a branch's image folder into
+    that branch's atlas, replacing any existing atlas. Returns the number of packed images.
+    '''
+    folder = Path(image_location).joinpath(branch)
+    path = atlas_path(image_location, branch)
+    images = sorted(image_path for image_path in folder.iterdir()
+                    if image_path.is_file() and
+                    image_path.suffix.lower() in IMAGE_SUFFIXES)
+    index = [HEADER.pack(ATLAS_MAGIC, ATLAS_VERSION, len(images))]
+    data = []
+    offset = 0
+    for image_path in images:
+        image = image_path.read_bytes()
+        width, height = image_size(image)
+        name = image_path.stem.encode('utf-8')
+        index.append(ENTRY.pack(offset, len(image), width, height, len(name)))
+        index.append(name)
+        data.append(image)
+        offset += len(image)
+    atomic_write(path, b''.join(index + data))
+    # index file written by version 1 atlases
+    path.with_name(path.name + '.idx').unlink(missing_ok=True)
+    return len(images)
+
+
+class RibbonAtlas():
+    '''
+    Read-only view of a branch's atlas. The file is read whole when opened,
+    so no handle or mapping stays open to stop it being replaced (Windows
+    won't replace a mapped file); image data is returned as memoryview
+    slices of it.
+    '''
+    def __init__(self, image_location, branch):
+        path = atlas_path(image_location, branch)
+        self.entries = dict()
+        self.view = memoryview(path.read_bytes())
+        magic, version, count = HEADER.unpack_from(self.view, 0)
+        if magic != ATLAS_MAGIC or version != ATLAS_VERSION:
+            raise ValueError(str(path) + " is not a v" +
+                             str(ATLAS_VERSION) + " ribbon atlas")
+        position = HEADER.size
+        entries = []
+        for _ in range(count):
+            offset, length, width, height, name_length = \
+                ENTRY.unpack_from(self.view, position)
+            position += ENTRY.size
+            name = bytes(self.view[position:position + name_length]).decode(
+                'utf-8')
+            position += name_length
+            entries.append((name, offset, length, width, height))
+        # offsets are relative to the image data following the index
+        for name, offset, length, width, height in entries:
+            if position + offset + length > len(self.view):
+                raise ValueError(str(path) + " is truncated")
+            self.entries[name] = (position + offset, length, width, height)
+
+    @classmethod
+    def open(cls, image_location, branch):
+        '''
+        Returns the branch's atlas, or None if it hasn't been built.
+        '''
+        try:
+            return cls(image_location, branch)
+        except (FileNotFoundError, ValueError, struct.error):
+            return None
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def size(self, name):
+        '''
+        Returns the (width, height) of a packed image.
+        '''
+        return self.entries[name][2:]
+
+    def read(self, name):
+        '''
+        Returns a packed image's encoded bytes as a zero-copy memoryview.
+        '''
+        offset, length = self.entries[name][:2]
+        return self.view[offset:offset + length]
+
+
+if __name__ == "__main__":
+    RIBBONS = Ribbons()
+    for BRANCH in sys.argv[1:] or sorted(RIBBONS.branches):
+        COUNT = build_atlas(RIBBONS.image_location, BRANCH)
+        print("Packed " + str(COUNT) + " " + BRANCH + " ribbons")
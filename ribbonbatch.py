@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''
+Renders a rack PNG for every member of a roster, without the GUI. The roster
+is streamed, so it can be any length: a CSV file with member_id, branch and
+ribbons columns (ribbons separated by semicolons), or a JSON Lines file with
+the same keys (ribbons as a list). Ribbons are given by name or ID.
+
+Racks are rendered and written by a pool of worker processes, each of which
+loads precedence and images once. Only a bounded number of rows are in
+flight at a time, so memory stays flat however large the roster is.
+
+Usage: python ribbonbatch.py ROSTER [-o racks] [--workers N]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import csv
+import json
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+import ribboncompositor
+from ribboncompositor import init_worker, UnknownRibbonError
+from ribbonfiles import atomic_write
+
+
+def read_roster(path):
+    '''
+    Yields (member ID, branch, [ribbon name or ID]) per roster row.
+    '''
+    path = Path(path)
+    with path.open('r', newline='') as roster:
+        if path.suffix.lower() in ('.jsonl', '.json'):
+            for line in roster:
+                if line.strip():
+                    row = json.loads(line)
+                    yield (str(row['member_id']), row['branch'],
+                           row['ribbons'])
+        else:
+            for row in csv.DictReader(roster):
+                ribbons = [ribbon.strip()
+                           for ribbon in row['ribbons'].split(';')]
+                yield (row['member_id'], row['branch'],
+                       [int(ribbon) if ribbon.isdigit() else ribbon
+                        for ribbon in ribbons if ribbon])
+
+
+def output_path(folder, member_id):
+    '''
+    Where a member's rack is written. Anything but letters, digits, dashes
+    and underscores in the member ID is replaced, so IDs can't escape the
+    output folder.
+    '''
+    return Path(folder).joinpath(re.sub(r'[^\w-]', '_', member_id) + '.png')
+
+
+def export_rack(path, branch, ribbons, scale):
+    '''
+    Renders one rack in a worker process and writes it atomically. Returns
+    None on success, or the reason the rack couldn't be rendered.
+    '''
+    try:
+        png = ribboncompositor.WORKER_COMPOSITOR.render(branch, ribbons, scale)
+        atomic_write(path, png)
+    except (UnknownRibbonError, ValueError) as error:
+        return error.args[0]
+    except OSError as error:
+        # e.g. a ribbon whose image is missing, or a full disk
+        return str(error)
+    return None
+
+
+def export_roster(roster, folder, workers=None, scale=1.0, in_flight=None):
+    '''
+    Renders every rack of a roster into folder, at most in_flight rows at a
+    time (by default 4 per worker). Prints progress as racks complete and
+    returns (racks written, rows failed).
+    '''
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    in_flight = in_flight or 4 * workers
+    written = failed = 0
+    start = time.perf_counter()
+
+    def collect(done):
+        nonlocal written, failed
+        for future in done:
+            member_id = pending.pop(future)
+            try:
+                error = future.result()
+            except Exception as exception:  # pylint: disable=broad-except
+                # a failed row shouldn't lose the rest of the roster
+                error = repr(exception)
+            if error is None:
+                written += 1
+            else:
+                failed += 1
+                print(member_id + ": " + error, file=sys.stderr)
+        count = written + failed
+        if count % 500 < len(done):
+            print("{} racks, {:.1f} racks/s".format(
+                count, count / (time.perf_counter() - start)), flush=True)
+
+    pending = dict()
+    with ProcessPoolExecutor(workers, initializer=init_worker) as executor:
+        for member_id, branch, ribbons in read_roster(roster):
+            if len(pending) >= in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(export_rack,
+                                     output_path(folder, member_id),
+                                     branch, ribbons, scale)
+            pending[future] = member_id
+        collect(wait(pending)[0])
+    elapsed = time.perf_counter() - start
+    print("Wrote {} racks ({} failed) in {:.1f} s, {:.1f} racks/s".format(
+        written, failed, elapsed, (written + failed) / elapsed))
+    return written, failed
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Render racks for a roster.")
+    PARSER.add_argument('roster', help="CSV or JSON Lines roster")
+    PARSER.add_argument('-o', '--output', default="racks",
+                        help="folder to write <member_id>.png files to")
+    PARSER.add_argument('--workers', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    PARSER.add_argument('--scale', type=float, default=1.0)
+    ARGS = PARSER.parse_args()
+    _, FAILED = export_roster(ARGS.roster, ARGS.output, ARGS.workers,
+                              ARGS.scale)
+    sys.exit(1 if FAILED else 0)
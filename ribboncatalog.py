@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+Per-branch catalog of ribbons, built once from precedence information so that
+the display and selector look ribbons up by ID instead of re-deriving names,
+filenames and image paths.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+from pathlib import Path
+import zlib
+
+
+def sanitize_filename(name):
+    '''
+    Turns a ribbon name into the filename (without extension) its image is
+    stored under. This is the only place that rule is defined.
+    '''
+    for character in " '/.":
+        name = name.replace(character, "")
+    return name
+
+
+def ribbon_id(branch, name):
+    '''
+    Stable integer ID for a ribbon. Derived from the branch and name only,
+    so it survives rescrapes and changes in precedence. Kept to 31 bits so
+    it fits in a Qt int.
+    '''
+    return zlib.crc32((branch + "/" + name).encode('utf-8')) & 0x7fffffff
+
+
+class RibbonRecord():
+    '''
+    Everything known about a single ribbon.
+    '''
+    __slots__ = ('ribbon_id', 'branch', 'precedence', 'name', 'path')
+
+    def __init__(self, branch, precedence, name, path):
+        self.ribbon_id = ribbon_id(branch, name)
+        self.branch = branch
+        self.precedence = precedence
+        self.name = name
+        self.path = path
+
+    def __repr__(self):
+        return "RibbonRecord(" + str(self.ribbon_id) + "," + self.name + \
+            "," + str(self.precedence) + ")"
+
+
+class RibbonCatalog():
+    '''
+    All ribbons of one branch in order of precedence, indexed by ID and by
+    name. Image paths are resolved with a single directory listing, so the
+    actual extension the scraper wrote is used without probing per ribbon.
+    '''
+    def __init__(self, branch, precedence, image_location):
+        self.branch = branch
+        folder = Path(image_location).joinpath(branch)
+        files = dict()
+        if folder.is_dir():
+            for path in sorted(folder.iterdir()):
+                files.setdefault(path.stem, path)
+        self.records = list()
+        self.by_id = dict()
+        self.by_name = dict()
+        for rank, name in sorted(precedence.items()):
+            filename = sanitize_filename(name)
+            path = files.get(filename, folder.joinpath(filename + ".jpeg"))
+            record = RibbonRecord(branch, rank, name, path)
+            if record.ribbon_id in self.by_id:
+                raise ValueError("Ribbon ID collision between " + name +
+                                 " and " + self.by_id[record.ribbon_id].name)
+            self.records.append(record)
+            self.by_id[record.ribbon_id] = record
+            self.by_name[name] = record
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, ribbon_id):
+        return self.by_id[ribbon_id]
+
+    def __contains__(self, ribbon_id):
+        return ribbon_id in self.by_id
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+'''
+Renders racks to PNG without Qt, for servers and batch jobs. Ribbons are
+arranged like RibbonGridLayout and RackCanvas: 3 per row, in order of
+precedence, starting from the bottom right.
+
+Usage: python ribboncompositor.py BRANCH RIBBON [RIBBON ...] [-o rack.png]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import collections
+import io
+import sys
+
+from PIL import Image
+
+from ribbonatlas import RibbonAtlas
+from ribbons import RACK_WIDTH, Ribbons, scale_bucket
+from ribbontrace import count, span
+
+
+# each worker process's compositor, created by init_worker
+WORKER_COMPOSITOR = None
+
+
+def init_worker():
+    '''
+    Process pool initializer: loads precedence and creates a compositor once
+    per worker process, rather than once per rack.
+    '''
+    global WORKER_COMPOSITOR  # pylint: disable=global-statement
+    ribbons = Ribbons()
+    ribbons.load_precedence()
+    WORKER_COMPOSITOR = RackCompositor(ribbons)
+
+
+def render_in_worker(branch, ribbons, scale=1.0):
+    '''
+    Renders a rack with the worker process's compositor.
+    '''
+    return WORKER_COMPOSITOR.render(branch, ribbons, scale)
+
+
+class UnknownRibbonError(KeyError):
+    '''
+    Raised when asked to render ribbons that aren't in the branch's catalog.
+    '''
+    def __init__(self, branch, names):
+        super().__init__(branch + " has no ribbon " + ", ".join(
+            str(name) for name in names))
+        self.branch = branch
+        self.names = names
+
+
+class RackCompositor():
+    '''
+    Composites ribbon images into rack PNGs. Scales are snapped to the GUI's
+    zoom steps, so the rescaled copies of ribbon images kept between renders
+    are bounded however many different scales are asked for. Rendered racks
+    are memoized by (branch, frozenset of ribbon IDs, scale),
+    least-recently-used first out once there are more than cache_size of
+    them.
+    '''
+    def __init__(self, ribbons, cache_size=1024):
+        self.ribbons = ribbons
+        self.cache_size = cache_size
+        self.racks = collections.OrderedDict()
+        self.images = dict()
+        self.atlases = dict()
+
+    def resolve(self, branch, ribbons):
+        '''
+        Turns ribbon IDs and/or names into catalog records. Raises
+        UnknownRibbonError for anything not in the branch's catalog.
+        '''
+        catalog = self.ribbons.catalog(branch)
+        records = set()
+        unknown = []
+        for ribbon in ribbons:
+            if isinstance(ribbon, int):
+                record = catalog.by_id.get(ribbon)
+            else:
+                record = catalog.by_name.get(ribbon)
+            if record is None:
+                unknown.append(ribbon)
+            else:
+                records.add(record)
+        if unknown:
+            raise UnknownRibbonError(branch, unknown)
+        return records
+
+    def render(self, branch, ribbons, scale=1.0):
+        '''
+        Returns the PNG bytes of a rack of the given ribbon IDs and/or names.
+        '''
+        records = self.resolve(branch, ribbons)
+        scale = scale_bucket(scale)
+        key = (branch, frozenset(record.ribbon_id for record in records),
+               scale)
+        png = self.racks.get(key)
+        if png is not None:
+            count('rack_cache.hits')
+            self.racks.move_to_end(key)
+            return png
+        count('rack_cache.misses')
+        output = io.BytesIO()
+        with span('compositor.render', branch=branch, ribbons=len(records)):
+            # low compression: the output is mostly flat colour anyway, and
+            # zlib's higher levels cost far more time than they save bytes
+            self.composite(records, scale).save(output, 'PNG',
+                                                compress_level=1)
+        png = output.getvalue()
+        self.racks[key] = png
+        if len(self.racks) > self.cache_size:
+            self.racks.popitem(last=False)
+        return png
+
+    def composite(self, records, scale=1.0):
+        '''
+        Pastes the ribbons' images into one image. Every slot is the size of
+        the largest ribbon, and each ribbon is centred in its slot.
+        '''
+        if not records:
+            raise ValueError("A rack needs at least one ribbon")
+        ordered = sorted(records, key=lambda record: -record.precedence)
+        images = [self.image(record, scale) for record in ordered]
+        width = max(image.width for image in images)
+        height = max(image.height for image in images)
+        columns = min(len(images), RACK_WIDTH)
+        rows = -(-len(images) // RACK_WIDTH)
+        rack = Image.new('RGBA', (columns * width, rows * height))
+        for index, image in enumerate(images):
+            row, col = divmod(index, RACK_WIDTH)
+            left = (columns - 1 - col) * width + (width - image.width) // 2
+            top = (rows - 1 - row) * height + (height - image.height) // 2
+            rack.paste(image, (left, top))
+        return rack
+
+    def image(self, record, scale=1.0):
+        '''
+        Returns a ribbon's decoded RGBA image at a scale, decoding and
+        rescaling it only the first time it's asked for.
+        '''
+        key = (record.ribbon_id, scale)
+        image = self.images.get(key)
+        if image is None:
+            if scale == 1.0:
+                image = self.decode(record)
+            else:
+                original = self.image(record)
+                size = (max(round(original.width * scale), 1),
+                        max(round(original.height * scale), 1))
+                image = original.resize(size, Image.LANCZOS)
+            self.images[key] = image
+        return image
+
+    def decode(self, record):
+        '''
+        Decodes a ribbon's image, from the branch atlas if it has one.
+        '''
+        if record.branch not in self.atlases:
+            self.atlases[record.branch] = RibbonAtlas.open(
+                self.ribbons.image_location, record.branch)
+        atlas = self.atlases[record.branch]
+        if atlas is not None and record.path.stem in atlas:
+            image = Image.open(io.BytesIO(atlas.read(record.path.stem)))
+        else:
+            image = Image.open(str(record.path))
+        return image.convert('RGBA')
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Render a rack to PNG.")
+    PARSER.add_argument('branch')
+    PARSER.add_argument('ribbon', nargs='+', help="ribbon name or ID")
+    PARSER.add_argument('--scale', type=float, default=1.0)
+    PARSER.add_argument('-o', '--output', default="rack.png")
+    ARGS = PARSER.parse_args()
+    RIBBONS = Ribbons()
+    RIBBONS.load_precedence()
+    COMPOSITOR = RackCompositor(RIBBONS)
+    try:
+        PNG = COMPOSITOR.render(
+            ARGS.branch, [int(ribbon) if ribbon.isdigit() else ribbon
+                          for ribbon in ARGS.ribbon], ARGS.scale)
+    except UnknownRibbonError as error:
+        sys.exit(error.args[0])
+    with open(ARGS.output, 'wb') as OUTPUT:
+        OUTPUT.write(PNG)
+    print("Wrote " + ARGS.output)
@@ -7,73 +7,269 @@ Author: Alden Davidson, adavidson@protonmail.ch
 Date: Summer 2019
 '''
 
-from pathlib import Path
+import bisect
+import contextlib
 
 from PyQt5.QtWidgets import (
     QGridLayout,
     QHBoxLayout,
     QLabel,
+    QSizePolicy,
     QWidget
 )
 from PyQt5.QtGui import (
-    QPixmap
+    QPainter,
+    QRegion
 )
 from PyQt5.QtCore import (
     pyqtSlot,
-    Qt
+    Qt,
+    QRect,
+    QSize
 )
 
-from ribbons import Ribbons
-from ribbonselector import RibbonListWidgetItem
+from ribbonimages import RibbonImageCache, ScaledRibbonCache
+from ribbons import RACK_WIDTH, scale_bucket
+from ribbontrace import count, span
 
 
 class RibbonDisplay(QWidget):
     '''
-    Displays the ribbons based on what was selected.
+    Displays the ribbons based on what was selected. By default every ribbon
+    is its own QLabel in a RibbonGridLayout; with canvas set, the whole rack
+    is painted by a single RackCanvas instead. Ctrl+scroll zooms the rack.
     '''
-    def __init__(self, branch):
+    def __init__(self, branch, ribbons, canvas=False):
         super().__init__()
         self.branch = branch
+        self.ribbons = ribbons
+        self.zoom = 1.0
+        # catalog records of the displayed ribbons, by ID
+        self.displayed = dict()
+        ScaledRibbonCache.instance().variant_ready.connect(
+            self.on_variant_ready)
         self.container_layout = QHBoxLayout()
-        self.layout = RibbonGridLayout(self)
+        self.layout = None
+        self.canvas = None
         self.container_layout.addStretch()
-        self.container_layout.addLayout(self.layout)
+        if canvas:
+            self.canvas = RackCanvas(branch)
+            self.container_layout.addWidget(self.canvas)
+        else:
+            self.layout = RibbonGridLayout(self)
+            self.container_layout.addLayout(self.layout)
         self.container_layout.addStretch()
         self.setLayout(self.container_layout)
 
-    def add_ribbon(self, ribbon):
+    @pyqtSlot(int)
+    def add_ribbon(self, ribbon_id):
         '''
         Adds a ribbon to the layout for display
         '''
+        record = self.ribbons.catalog(self.branch)[ribbon_id]
+        self.displayed[record.ribbon_id] = record
+        if self.canvas is not None:
+            self.canvas.add_ribbon(record)
+            return
         # add visible image
         cell = QLabel()
         cell.setAlignment(Qt.AlignCenter)
-        image_path = self.create_image_path(ribbon)
-        image = QPixmap(str(image_path))
-        cell.setPixmap(image)
-        ribbon_pair = (ribbon, cell)
+        with span('display.load_pixmap', ribbon=record.name):
+            cell.setPixmap(self.cell_pixmap(record))
+        ribbon_pair = (record, cell)
         self.layout.add_ribbon(ribbon_pair)
         self.layout.rearrange(ribbon_pair)
 
-    @pyqtSlot(RibbonListWidgetItem)
-    def remove_ribbon(self, ribbon):
+    @pyqtSlot(int)
+    def remove_ribbon(self, ribbon_id):
         '''
         Removes a ribbon from the layout display
         '''
-        ribbon_pair, removed_index = self.layout.remove_ribbon(ribbon)
+        record = self.displayed.pop(ribbon_id)
+        if self.canvas is not None:
+            self.canvas.remove_ribbon(record)
+            return
+        ribbon_pair, removed_index = self.layout.remove_ribbon(record)
         self.layout.rearrange(ribbon_pair, removed_index)
 
-    def create_image_path(self, ribbon):
+    @pyqtSlot(list)
+    def set_ribbons(self, ribbon_ids):
+        '''
+        Displays exactly the given ribbons. Only the difference from what's
+        displayed now is added or removed, and the rack is sorted and laid
+        out once for the whole change.
+        '''
+        catalog = self.ribbons.catalog(self.branch)
+        wanted = set(ribbon_ids)
+        removed = [self.displayed.pop(ribbon_id)
+                   for ribbon_id in list(self.displayed)
+                   if ribbon_id not in wanted]
+        added = [catalog[ribbon_id] for ribbon_id in wanted
+                 if ribbon_id not in self.displayed]
+        for record in added:
+            self.displayed[record.ribbon_id] = record
+        self.replace_ribbons(removed, added)
+
+    def reload(self, changed_ids=()):
+        '''
+        Brings the rack in line with a rebuilt catalog, keeping the user's
+        selection: ribbons no longer in the catalog are removed, and those
+        that were re-ranked or whose image changed (changed_ids) are
+        replaced, in one bulk operation. Other ribbons aren't touched.
+        '''
+        catalog = self.ribbons.catalog(self.branch)
+        changed_ids = set(changed_ids)
+        stale = [record for ribbon_id, record in self.displayed.items()
+                 if ribbon_id not in catalog or ribbon_id in changed_ids or
+                 catalog[ribbon_id].precedence != record.precedence]
+        if not stale:
+            return
+        fresh = [catalog[record.ribbon_id] for record in stale
+                 if record.ribbon_id in catalog]
+        for record in stale:
+            del self.displayed[record.ribbon_id]
+        for record in fresh:
+            self.displayed[record.ribbon_id] = record
+        self.replace_ribbons(stale, fresh)
+
+    def replace_ribbons(self, removed, added):
+        '''
+        Swaps the removed records for the added ones in the layout or
+        canvas, sorting and laying out once.
+        '''
+        if self.canvas is not None:
+            self.canvas.replace_ribbons(removed, added)
+            return
+        added_pairs = []
+        for record in added:
+            cell = QLabel()
+            cell.setAlignment(Qt.AlignCenter)
+            cell.setPixmap(self.cell_pixmap(record))
+            added_pairs.append((record, cell))
+        self.layout.replace_ribbons(removed, added_pairs)
+
+    def cell_pixmap(self, record):
+        '''
+        Returns a ribbon's pixmap for the current zoom and screen. Until the
+        smoothly scaled variant is ready, a quick nearest-neighbour scale of
+        the original stands in for it.
+        '''
+        pixmap = ScaledRibbonCache.instance().scaled(
+            record, self.zoom, self.devicePixelRatioF())
+        if pixmap is None:
+            pixmap = RibbonImageCache.instance().pixmap(record)
+            pixmap = pixmap.scaled(pixmap.size() * self.zoom,
+                                   Qt.KeepAspectRatio, Qt.FastTransformation)
+        return pixmap
+
+    def set_zoom(self, zoom):
+        '''
+        Sets the rack's zoom level, snapped to the nearest scale bucket.
+        '''
+        zoom = scale_bucket(zoom)
+        if zoom == self.zoom:
+            return
+        self.zoom = zoom
+        if self.canvas is not None:
+            self.canvas.set_zoom(zoom)
+            return
+        with self.layout.batch():
+            for record, cell in self.layout.tracker:
+                cell.setPixmap(self.cell_pixmap(record))
+
+    @pyqtSlot(int)
+    def on_variant_ready(self, ribbon_id):
+        '''
+        Swaps in a newly scaled variant for a displayed ribbon.
+        '''
+        record = self.displayed.get(ribbon_id)
+        if record is None:
+            return
+        if self.canvas is not None:
+            self.canvas.refresh_ribbon(record)
+            return
+        cell = self.layout.tracker.pairs[record.precedence][1]
+        cell.setPixmap(self.cell_pixmap(record))
+
+    def wheelEvent(self, event):  # pylint: disable=invalid-name
+        '''
+        Zooms in or out a step on Ctrl+scroll.
+        '''
+        if not event.modifiers() & Qt.ControlModifier:
+            super(RibbonDisplay, self).wheelEvent(event)
+            return
+        step = 0.25 if event.angleDelta().y() > 0 else -0.25
+        self.set_zoom(self.zoom + step)
+
+
+class RibbonTracker():
+    '''
+    Ribbon/cell pairs in display order (highest precedence number first).
+    Kept sorted by bisect insertion on negated precedence, with a dictionary
+    from precedence to pair, so lookups never scan the list.
+    '''
+    def __init__(self):
+        self.keys = list()
+        self.pairs = dict()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        return self.pairs[-self.keys[index]]
+
+    def __iter__(self):
+        return (self.pairs[-key] for key in self.keys)
+
+    def index(self, ribbon):
+        '''
+        Returns the display index of a tracked ribbon.
+        '''
+        index = bisect.bisect_left(self.keys, -ribbon.precedence)
+        if index == len(self.keys) or self.keys[index] != -ribbon.precedence:
+            raise ValueError(repr(ribbon) + " is not tracked")
+        return index
+
+    def insert(self, ribbon_pair):
+        '''
+        Tracks a (ribbon, cell) pair, returning its display index.
+        '''
+        key = -ribbon_pair[0].precedence
+        index = bisect.bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.pairs[-key] = ribbon_pair
+        return index
+
+    def pop(self, ribbon):
+        '''
+        Stops tracking a ribbon, returning its (ribbon, cell) pair and the
+        display index it had.
+        '''
+        index = self.index(ribbon)
+        del self.keys[index]
+        return self.pairs.pop(ribbon.precedence), index
+
+    def replace(self, removed, added_pairs):
         '''
-        Constructs a proper filepath based on branch
+        Stops tracking the removed ribbons and tracks the added pairs, with
+        a single sort. Returns the removed pairs and the first display index
+        that changed.
         '''
-        filename = ribbon.text()
-        filename = filename.replace(" ", "")
-        filename = filename.replace("'", "")
-        filename = filename.replace("/", "")
-        basepath = Ribbons().image_location
-        filepath = Path(self.branch + "/" + filename + ".jpeg")
-        return basepath.joinpath(filepath)
+        removed_pairs = [self.pairs.pop(ribbon.precedence)
+                         for ribbon in removed]
+        for ribbon_pair in added_pairs:
+            self.pairs[ribbon_pair[0].precedence] = ribbon_pair
+        old_keys = self.keys
+        self.keys = sorted(-precedence for precedence in self.pairs)
+        # a ribbon swapped for a fresh pair at the same precedence leaves
+        # the keys unchanged, so the start is taken from the positions of
+        # the removed and added ribbons rather than from comparing keys
+        changed = [bisect.bisect_left(old_keys, -ribbon.precedence)
+                   for ribbon in removed]
+        changed.extend(
+            bisect.bisect_left(self.keys, -ribbon_pair[0].precedence)
+            for ribbon_pair in added_pairs)
+        return removed_pairs, min(changed, default=len(self.keys))
 
 
 class RibbonGridLayout(QGridLayout):
@@ -85,47 +281,220 @@ class RibbonGridLayout(QGridLayout):
         super().__init__()
         self.setSpacing(0)
         self.setOriginCorner(Qt.BottomRightCorner)
-        self.tracker = list()
+        self.tracker = RibbonTracker()
+        # grid position each cell is currently placed at
+        self.positions = dict()
 
     def add_ribbon(self, ribbon_pair):
         '''
-        Inserts a ribbon into the grid layout and the ribbon tracking list
+        Inserts a ribbon into the ribbon tracker. The cell is placed in the
+        grid by the following rearrange().
         '''
-        # insert to tracker
-        self.tracker.append(ribbon_pair)
-        self.tracker.sort(reverse=True)
-        # calculate ribbon position
-        row, col = divmod(self.tracker.index(ribbon_pair), 3)
-        # add to display
-        self.addWidget(ribbon_pair[1], row, col)
+        return self.tracker.insert(ribbon_pair)
 
-    def remove_ribbon(self, ribbon_name):
+    def remove_ribbon(self, ribbon):
         '''
-        Removes a ribbon from the grid layout and the ribbon tracking list
+        Removes a ribbon from the grid layout and the ribbon tracker
         '''
-        # find (ribbon,cell) pair in tracker
-        # Must get 0th item since this returns a list containing the tuple
-        ribbon_pair = [item for item in self.tracker if ribbon_name in item][0]
-        index = self.tracker.index(ribbon_pair)
-        # remove parent of cell to destroy it, and stop tracking it
-        ribbon_pair[1].setParent(None)
-        self.tracker.remove(ribbon_pair)
+        ribbon_pair, index = self.tracker.pop(ribbon)
+        self.discard(ribbon_pair[1])
         return ribbon_pair, index
 
+    def replace_ribbons(self, removed, added_pairs):
+        '''
+        Removes and adds many ribbons as one operation: the tracker is
+        sorted once and the cells from the first changed index onward are
+        placed in a single batch.
+        '''
+        with self.batch():
+            removed_pairs, start = self.tracker.replace(removed, added_pairs)
+            for _, cell in removed_pairs:
+                self.discard(cell)
+            for index in range(start, len(self.tracker)):
+                self.place(self.tracker[index][1], index)
+
+    def discard(self, cell):
+        '''
+        Removes a cell from the grid and destroys it.
+        '''
+        # remove parent of cell to destroy it, and stop tracking it
+        self.removeWidget(cell)
+        cell.setParent(None)
+        del self.positions[cell]
+
     def rearrange(self, ribbon_pair, removed_index=None):
         '''
-        Rearranges all the ribbons in the display based upon the newly-inserted
-        ribbon.
+        Rearranges the ribbons after an insertion or removal. Only cells
+        from the changed index onward can move, and of those only the ones
+        whose (row, col) actually changed are touched.
         '''
-        max_index = len(self.tracker) - 1
         if removed_index is None:
-            new_ribbon_index = self.tracker.index(ribbon_pair)
+            start = self.tracker.index(ribbon_pair[0])
+        else:
+            start = removed_index
+        with span('layout.rearrange', start=start), self.batch():
+            for index in range(start, len(self.tracker)):
+                self.place(self.tracker[index][1], index)
+
+    def place(self, cell, index):
+        '''
+        Moves a cell to the grid position for a display index, if it isn't
+        already there.
+        '''
+        position = divmod(index, RACK_WIDTH)
+        if self.positions.get(cell) == position:
+            return
+        count('layout.moves')
+        if cell in self.positions:
+            self.removeWidget(cell)
+        self.addWidget(cell, *position)
+        self.positions[cell] = position
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        Suspends layout and repaints while cells are moved, so Qt lays out
+        and paints the rack once per operation rather than once per cell.
+        '''
+        parent = self.parentWidget()
+        if parent is not None:
+            parent.setUpdatesEnabled(False)
+        self.setEnabled(False)
+        try:
+            yield
+        finally:
+            self.setEnabled(True)
+            self.update()
+            if parent is not None:
+                parent.setUpdatesEnabled(True)
+
+
+class RackCanvas(QWidget):
+    '''
+    Paints a whole rack in one widget, using the same 3-wide, bottom-right
+    origin arrangement as RibbonGridLayout. The rack is anchored to the
+    bottom centre of the widget, so a ribbon's slot rectangle depends only
+    on its index and a change only repaints the slots from the changed index
+    onward.
+    '''
+    def __init__(self, branch):
+        super().__init__()
+        self.branch = branch
+        # pairs are (record, unscaled pixmap) rather than (record, cell)
+        self.tracker = RibbonTracker()
+        self.cell_size = QSize(0, 0)
+        self.zoom = 1.0
+        self.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
+
+    def add_ribbon(self, ribbon):
+        '''
+        Adds a ribbon to the rack and repaints the slots it shifted.
+        '''
+        with span('display.load_pixmap', ribbon=ribbon.name):
+            pixmap = RibbonImageCache.instance().pixmap(ribbon)
+        index = self.tracker.insert((ribbon, pixmap))
+        if self.fit_cell(pixmap):
+            self.update()
         else:
-            new_ribbon_index = removed_index - 1
-        for index in range(max_index, new_ribbon_index, -1):
-            # get item from current position
-            moving_pair = self.tracker[index]
-            moving_pair[1].setParent(None)
-            # re-insert item to new position
-            row, col = divmod(index, 3)
-            self.addWidget(moving_pair[1], row, col)
+            self.update_slots(index, len(self.tracker))
+        self.updateGeometry()
+
+    def remove_ribbon(self, ribbon):
+        '''
+        Removes a ribbon from the rack and repaints the slots it shifted,
+        including the now-empty last slot.
+        '''
+        _, index = self.tracker.pop(ribbon)
+        self.update_slots(index, len(self.tracker) + 1)
+        self.updateGeometry()
+
+    def replace_ribbons(self, removed, added):
+        '''
+        Removes and adds many ribbons with a single sort and repaint.
+        '''
+        cache = RibbonImageCache.instance()
+        added_pairs = [(ribbon, cache.pixmap(ribbon)) for ribbon in added]
+        for _, pixmap in added_pairs:
+            self.fit_cell(pixmap)
+        self.tracker.replace(removed, added_pairs)
+        self.updateGeometry()
+        self.update()
+
+    def set_zoom(self, zoom):
+        '''
+        Sets the zoom level and repaints the whole rack.
+        '''
+        self.zoom = zoom
+        self.updateGeometry()
+        self.update()
+
+    def refresh_ribbon(self, ribbon):
+        '''
+        Repaints a single ribbon's slot, e.g. once its scaled variant exists.
+        '''
+        self.update(self.slot_rect(self.tracker.index(ribbon)))
+
+    def fit_cell(self, pixmap):
+        '''
+        Grows the cell size to fit a pixmap. Returns True if it grew, since
+        then every slot moves.
+        '''
+        cell_size = self.cell_size.expandedTo(pixmap.size())
+        if cell_size == self.cell_size:
+            return False
+        self.cell_size = cell_size
+        return True
+
+    def slot_rect(self, index):
+        '''
+        Rectangle of the slot for a display index, in widget coordinates.
+        '''
+        row, col = divmod(index, RACK_WIDTH)
+        cell_size = self.cell_size * self.zoom
+        width, height = cell_size.width(), cell_size.height()
+        left = (self.width() - RACK_WIDTH * width) // 2
+        return QRect(left + (RACK_WIDTH - 1 - col) * width,
+                     self.height() - (row + 1) * height, width, height)
+
+    def update_slots(self, start, stop):
+        '''
+        Schedules a repaint of the slots from start up to stop.
+        '''
+        region = QRegion()
+        for index in range(start, stop):
+            region = region.united(self.slot_rect(index))
+        self.update(region)
+
+    def sizeHint(self):  # pylint: disable=invalid-name
+        '''
+        Just large enough for the current rack.
+        '''
+        rows = -(-len(self.tracker) // RACK_WIDTH)
+        cell_size = self.cell_size * self.zoom
+        return QSize(RACK_WIDTH * cell_size.width(),
+                     rows * cell_size.height())
+
+    def paintEvent(self, event):  # pylint: disable=invalid-name
+        '''
+        Paints every ribbon whose slot intersects the dirty region, centred in
+        its slot. Pre-scaled variants are drawn at their native size; until a
+        variant is ready the painter stretches the original instead.
+        '''
+        painter = QPainter(self)
+        region = event.region()
+        ratio = self.devicePixelRatioF()
+        scaled_cache = ScaledRibbonCache.instance()
+        for index, (ribbon, original) in enumerate(self.tracker):
+            rect = self.slot_rect(index)
+            if not region.intersects(rect):
+                continue
+            size = original.size() * self.zoom
+            pixmap = scaled_cache.scaled(ribbon, self.zoom, ratio)
+            if pixmap is None:
+                pixmap = original
+            painter.drawPixmap(
+                QRect(rect.x() + (rect.width() - size.width()) // 2,
+                      rect.y() + (rect.height() - size.height()) // 2,
+                      size.width(), size.height()),
+                pixmap)
+        painter.end()
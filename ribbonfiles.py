@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+'''
+Atomic file writes, shared by everything that stores data: the precedence
+store and JSON, the scrape manifest, images, atlases, thumbnails, profiles,
+traces and exported racks.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import os
+from pathlib import Path
+import threading
+
+
+def atomic_write(path, data, durable=False):
+    '''
+    Writes bytes to path atomically. They go to a temporary file in the same
+    folder, named after the writing process and thread so concurrent writers
+    never share one, which is then renamed over path: readers see the old
+    file or the new one, never part of either. If durable is set, the data
+    is flushed to disk before the rename.
+    '''
+    path = Path(path)
+    temp_path = path.with_name("{}.{}-{}.tmp".format(
+        path.name, os.getpid(), threading.get_ident()))
+    try:
+        with temp_path.open('wb') as temp_file:
+            temp_file.write(data)
+            if durable:
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+        os.replace(str(temp_path), str(path))
+    except BaseException:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
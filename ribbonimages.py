@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+'''
+Shared caches of ribbon images, so that displaying a ribbon that has been
+shown before (in any rack, at any zoom, or as a list icon) costs no path
+building, no file I/O and no rescaling.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import collections
+import threading
+
+from PyQt5.QtGui import (
+    QIcon,
+    QImage,
+    QPixmap,
+    QPixmapCache
+)
+from PyQt5.QtCore import (
+    pyqtSignal,
+    pyqtSlot,
+    Qt,
+    QBuffer,
+    QCoreApplication,
+    QIODevice,
+    QObject,
+    QRunnable,
+    QSize,
+    QThreadPool
+)
+
+from ribbonatlas import RibbonAtlas
+from ribbonfiles import atomic_write
+from ribbons import Ribbons, scale_bucket
+from ribbontrace import count, span
+
+
+class SharedCache():
+    '''
+    Gives a cache class one instance shared by the whole application. The
+    caches fill themselves on the global thread pool, whose tasks could
+    otherwise outlive them, so creating the first one also arranges for
+    background work to stop when the application quits.
+    '''
+    _instance = None
+    # set once the application is quitting; shared by every cache
+    stopping = False
+    hooked = False
+
+    @classmethod
+    def instance(cls):
+        '''
+        Returns the cache shared by the whole application. Must first be
+        called once a QApplication exists.
+        '''
+        if cls._instance is None:
+            cls._instance = cls()
+            if not SharedCache.hooked:
+                QCoreApplication.instance().aboutToQuit.connect(
+                    stop_background_work)
+                SharedCache.hooked = True
+        return cls._instance
+
+
+def stop_background_work():
+    '''
+    Drops queued tasks from the global thread pool and waits for the
+    running ones, so none of them reports to a cache that's being deleted.
+    '''
+    SharedCache.stopping = True
+    pool = QThreadPool.globalInstance()
+    pool.clear()
+    pool.waitForDone()
+
+
+def report(cache, signal, *args):
+    '''
+    Emits one of a cache's signals from a pool task, unless the application
+    is quitting. A Python exception escaping a Qt virtual such as run()
+    aborts the process, so a cache deleted under a late task is ignored.
+    '''
+    if SharedCache.stopping:
+        return
+    try:
+        getattr(cache, signal).emit(*args)
+    except RuntimeError:
+        # the cache's C++ object has already been deleted
+        pass
+
+
+class RibbonImageCache(SharedCache):
+    '''
+    Caches ribbon images by catalog record. Decoded pixmaps live in
+    QPixmapCache, which evicts least-recently-used entries once the limit
+    (in KiB) is reached. Use instance() to share one cache between all
+    racks.
+    '''
+
+    def __init__(self, limit=20480):
+        self.image_location = Ribbons().image_location
+        self.atlases = dict()
+        self.prewarmed = dict()
+        self.lock = threading.Lock()
+        QPixmapCache.setCacheLimit(limit)
+
+    def atlas(self, branch):
+        '''
+        Returns the branch's packed image atlas, or None if it hasn't been
+        built, in which case images are read from their individual files.
+        '''
+        if branch not in self.atlases:
+            self.atlases[branch] = RibbonAtlas.open(
+                self.image_location, branch)
+        return self.atlases[branch]
+
+    def load_image(self, record):
+        '''
+        Decodes a ribbon's image, from the branch atlas if it has one.
+        '''
+        atlas = self.atlas(record.branch)
+        with span('images.decode', ribbon=record.name):
+            if atlas is not None and record.path.stem in atlas:
+                image = QImage()
+                # Qt needs a bytes object to decode from
+                image.loadFromData(bytes(atlas.read(record.path.stem)))
+                return image
+            return QImage(str(record.path))
+
+    def pixmap(self, record):
+        '''
+        Returns the pixmap for a ribbon, decoding it only on a cache miss.
+        '''
+        key = str(record.ribbon_id)
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None and not pixmap.isNull():
+            count('pixmap_cache.hits')
+        else:
+            count('pixmap_cache.misses')
+            with self.lock:
+                image = self.prewarmed.pop(record.ribbon_id, None)
+            if image is None:
+                image = self.load_image(record)
+            pixmap = QPixmap.fromImage(image)
+            QPixmapCache.insert(key, pixmap)
+        return pixmap
+
+    def invalidate(self, record):
+        '''
+        Drops a ribbon's cached image, e.g. after its file changed.
+        '''
+        QPixmapCache.remove(str(record.ribbon_id))
+        with self.lock:
+            self.prewarmed.pop(record.ribbon_id, None)
+
+    def reopen_atlas(self, branch):
+        '''
+        Forgets a branch's atlas, so it's reopened the next time it's used,
+        e.g. after it was rebuilt.
+        '''
+        self.atlases.pop(branch, None)
+
+    def prewarm(self, records):
+        '''
+        Decodes the given ribbons' images on a background thread. QPixmaps
+        can only be created on the GUI thread, so the decoded QImages are
+        held until pixmap() first asks for them.
+        '''
+        thread = threading.Thread(target=self.load_images,
+                                  args=(list(records),), daemon=True)
+        thread.start()
+        return thread
+
+    def load_images(self, records):
+        '''
+        Decodes images for prewarm().
+        '''
+        for record in records:
+            image = self.load_image(record)
+            with self.lock:
+                self.prewarmed[record.ribbon_id] = image
+
+
+class ScaleRunnable(QRunnable):
+    '''
+    Decodes and smoothly rescales one ribbon image on the thread pool.
+    '''
+    def __init__(self, cache, record, bucket, ratio):
+        super().__init__()
+        self.cache = cache
+        self.record = record
+        self.bucket = bucket
+        self.ratio = ratio
+
+    def run(self):
+        image = RibbonImageCache.instance().load_image(self.record)
+        factor = self.bucket * self.ratio
+        image = image.scaled(round(image.width() * factor),
+                             round(image.height() * factor),
+                             Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        report(self.cache, 'image_scaled', self.record.ribbon_id,
+               self.bucket, self.ratio, image)
+
+
+class ScaledRibbonCache(QObject, SharedCache):
+    '''
+    Pre-scaled ribbon pixmaps keyed by (ribbon ID, zoom bucket, device pixel
+    ratio). Missing variants are scaled on the global thread pool and
+    announced through variant_ready; least-recently-used variants are
+    evicted once their total size exceeds the budget (in bytes). Use
+    instance() to share one cache between all racks.
+    '''
+    variant_ready = pyqtSignal(int)
+    image_scaled = pyqtSignal(int, float, float, QImage)
+
+    def __init__(self, budget=32 * 1024 * 1024):
+        super().__init__()
+        self.budget = budget
+        self.used = 0
+        self.variants = collections.OrderedDict()
+        self.pending = set()
+        self.image_scaled.connect(self.on_image_scaled)
+
+    def scaled(self, record, zoom, ratio=1.0):
+        '''
+        Returns the ribbon's pixmap at a zoom level and device pixel ratio,
+        or None if that variant is still being generated.
+        '''
+        bucket = scale_bucket(zoom)
+        if bucket == 1.0 and ratio == 1.0:
+            return RibbonImageCache.instance().pixmap(record)
+        key = (record.ribbon_id, bucket, ratio)
+        pixmap = self.variants.get(key)
+        if pixmap is not None:
+            count('scaled_cache.hits')
+            self.variants.move_to_end(key)
+            return pixmap
+        count('scaled_cache.misses')
+        if key not in self.pending:
+            self.pending.add(key)
+            QThreadPool.globalInstance().start(
+                ScaleRunnable(self, record, bucket, ratio))
+        return None
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        '''
+        Approximate memory held by a pixmap.
+        '''
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def invalidate(self, ribbon_id):
+        '''
+        Drops every variant of a ribbon, e.g. after its image changed.
+        '''
+        for key in [key for key in self.variants if key[0] == ribbon_id]:
+            self.used -= self.pixmap_bytes(self.variants.pop(key))
+
+    @pyqtSlot(int, float, float, QImage)
+    def on_image_scaled(self, ribbon_id, bucket, ratio, image):
+        '''
+        Stores a finished variant, evicting old ones to stay in budget.
+        '''
+        key = (ribbon_id, bucket, ratio)
+        self.pending.discard(key)
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(ratio)
+        self.variants[key] = pixmap
+        self.used += self.pixmap_bytes(pixmap)
+        while self.used > self.budget and len(self.variants) > 1:
+            _, evicted = self.variants.popitem(last=False)
+            self.used -= self.pixmap_bytes(evicted)
+        self.variant_ready.emit(ribbon_id)
+
+
+# bounding box of the icons shown in the selector lists
+THUMBNAIL_SIZE = QSize(48, 16)
+
+
+class ThumbnailRunnable(QRunnable):
+    '''
+    Produces one ribbon's thumbnail on the thread pool: read from the disk
+    cache if it's at least as new as the ribbon image, otherwise decoded,
+    scaled and written to the disk cache.
+    '''
+    def __init__(self, cache, record):
+        super().__init__()
+        self.cache = cache
+        self.record = record
+
+    def run(self):
+        path = self.cache.thumbnail_path(self.record)
+        try:
+            fresh = path.stat().st_mtime >= self.record.path.stat().st_mtime
+        except FileNotFoundError:
+            # no thumbnail yet, or only an atlas to compare against
+            fresh = path.exists()
+        if fresh:
+            image = QImage(str(path))
+        else:
+            image = RibbonImageCache.instance().load_image(self.record)
+            image = image.scaled(THUMBNAIL_SIZE, Qt.KeepAspectRatio,
+                                 Qt.SmoothTransformation)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            png = QBuffer()
+            png.open(QIODevice.WriteOnly)
+            if image.save(png, 'PNG'):
+                try:
+                    atomic_write(path, bytes(png.data()))
+                except OSError:
+                    # not kept on disk, so it's just made again next time
+                    pass
+        report(self.cache, 'image_loaded', self.record.ribbon_id, image)
+
+
+class ThumbnailCache(QObject, SharedCache):
+    '''
+    Small ribbon icons for the selector lists, by ribbon ID. Icons are only
+    made when asked for, i.e. for rows Qt is about to paint; misses are
+    filled on the global thread pool and announced through thumbnail_ready.
+    Thumbnails are also kept on disk, one PNG per ribbon, so later launches
+    skip decoding and scaling. Use instance() to share one cache between all
+    racks.
+    '''
+    thumbnail_ready = pyqtSignal(int)
+    image_loaded = pyqtSignal(int, QImage)
+
+    def __init__(self):
+        super().__init__()
+        self.location = Ribbons().thumbnail_location
+        self.icons = dict()
+        self.pending = set()
+        self.image_loaded.connect(self.on_image_loaded)
+
+    def thumbnail_path(self, record):
+        '''
+        Where a ribbon's thumbnail is kept on disk.
+        '''
+        return self.location.joinpath(record.branch,
+                                      str(record.ribbon_id) + ".png")
+
+    def icon(self, record):
+        '''
+        Returns a ribbon's icon, or None if it's still being made.
+        '''
+        icon = self.icons.get(record.ribbon_id)
+        if icon is None:
+            count('thumbnail_cache.misses')
+            self.request(record)
+        else:
+            count('thumbnail_cache.hits')
+        return icon
+
+    def request(self, record):
+        '''
+        Starts making a ribbon's icon in the background, unless it's already
+        cached or on its way.
+        '''
+        if record.ribbon_id in self.icons or record.ribbon_id in self.pending:
+            return
+        self.pending.add(record.ribbon_id)
+        QThreadPool.globalInstance().start(ThumbnailRunnable(self, record))
+
+    def invalidate(self, record):
+        '''
+        Drops a ribbon's icon, in memory and on disk, e.g. after its image
+        changed.
+        '''
+        self.icons.pop(record.ribbon_id, None)
+        try:
+            self.thumbnail_path(record).unlink()
+        except FileNotFoundError:
+            pass
+
+    @pyqtSlot(int, QImage)
+    def on_image_loaded(self, ribbon_id, image):
+        '''
+        Turns a finished thumbnail into an icon on the GUI thread.
+        '''
+        self.pending.discard(ribbon_id)
+        self.icons[ribbon_id] = QIcon(QPixmap.fromImage(image))
+        self.thumbnail_ready.emit(ribbon_id)
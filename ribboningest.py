@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+Normalizes scraped ribbon images before they're stored: every image is
+verified, re-encoded as JPEG at the canonical ribbon size and stripped of
+any metadata, so the display never has to cope with mixed formats or rescale
+on load. The CPU-bound work runs in a process pool, so the scraper can keep
+downloading and parsing while images are being normalized.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import multiprocessing
+
+from PIL import Image, ImageOps
+
+# (width, height) of a normalized ribbon image, that of most AFPC images
+RIBBON_SIZE = (90, 25)
+INGEST_FORMAT = 'JPEG'
+INGEST_SUFFIX = '.jpeg'
+# full chroma resolution, since ribbons are mostly thin coloured stripes
+INGEST_OPTIONS = dict(quality=95, subsampling=0)
+# images handed to a worker at once; a single small image takes less time to
+# normalize than to pass between processes
+BATCH_SIZE = 16
+
+
+class InvalidImageError(ValueError):
+    '''
+    Raised for downloaded data that isn't a readable image.
+    '''
+
+
+def normalize_image(data):
+    '''
+    Verifies image data and returns it as JPEG bytes at RIBBON_SIZE, without
+    metadata. Images of another aspect ratio, such as the 99x26 AFROTC
+    ones, are centre-cropped rather than squashed. Runs in an ingest worker
+    process.
+    '''
+    try:
+        # verify() checks the file's structure but leaves it unusable, so
+        # the image is opened again to decode it
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        with Image.open(io.BytesIO(data)) as image:
+            normalized = image.convert('RGB')
+    except (OSError, SyntaxError, ValueError,
+            Image.DecompressionBombError) as error:
+        raise InvalidImageError(str(error))
+    if normalized.size != RIBBON_SIZE:
+        # scaled to cover RIBBON_SIZE and the overflow cropped evenly off
+        # both sides, so stripes keep their proportions; padding would show
+        # as bars around the ribbon in a rack
+        normalized = ImageOps.fit(normalized, RIBBON_SIZE, Image.LANCZOS)
+    output = io.BytesIO()
+    # nothing from the source's info (EXIF, ICC profile, comments) is
+    # passed to save(), so none of it is written
+    normalized.save(output, INGEST_FORMAT, **INGEST_OPTIONS)
+    return output.getvalue()
+
+
+def normalize_images(images):
+    '''
+    Normalizes a batch of images in an ingest worker process, returning for
+    each either its JPEG bytes or the InvalidImageError it failed with, so
+    one bad image doesn't lose the rest of the batch.
+    '''
+    results = []
+    for data in images:
+        try:
+            results.append(normalize_image(data))
+        except InvalidImageError as error:
+            results.append(error)
+    return results
+
+
+class RibbonIngest():
+    '''
+    Pool of worker processes normalizing images. Workers are spawned rather
+    than forked, since the scraper may run next to Qt's threads.
+    '''
+    def __init__(self, max_workers=None):
+        self.pool = ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, images):
+        '''
+        Starts normalizing a batch of image data, returning a Future of its
+        normalize_images() results.
+        '''
+        return self.pool.submit(normalize_images,
+                                [bytes(data) for data in images])
+
+    def shutdown(self, cancel=False):
+        '''
+        Stops the workers, after finishing queued images unless cancel is
+        set.
+        '''
+        self.pool.shutdown(wait=not cancel, cancel_futures=cancel)
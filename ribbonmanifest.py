@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''
+Keeps track of what the scraper fetched and wrote last time, so that repeat
+scrapes can send conditional requests, skip rewriting unchanged images, and
+report what actually changed upstream.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import hashlib
+import json
+from pathlib import Path
+
+from ribbonfiles import atomic_write
+from ribbontrace import count, span
+
+
+class ScrapeManifest():
+    '''
+    Records HTTP validators (ETag/Last-Modified) and content hashes for each
+    fetched page, and content hashes for each written file. Stored as JSON
+    next to the precedence file.
+    '''
+    def __init__(self, location):
+        self.location = Path(location)
+        self.pages = dict()
+        self.files = dict()
+
+    def load(self):
+        '''
+        Loads the manifest from disk. A missing or unreadable manifest just
+        means there is nothing to compare against, so everything is fetched.
+        '''
+        try:
+            with self.location.open('r') as filepath:
+                manifest = json.load(filepath)
+            self.pages = manifest.get('pages', dict())
+            self.files = manifest.get('files', dict())
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self.pages = dict()
+            self.files = dict()
+
+    def store(self):
+        '''
+        Writes the manifest atomically, so an interrupted scrape never
+        leaves a half-written manifest behind.
+        '''
+        self.location.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.location, json.dumps(
+            dict(pages=self.pages, files=self.files), sort_keys=True,
+            indent=4, separators=(',', ': ')).encode('utf-8'))
+
+    def conditional_headers(self, url):
+        '''
+        Builds the If-None-Match/If-Modified-Since headers for a URL fetched
+        on a previous scrape.
+        '''
+        headers = dict()
+        page = self.pages.get(url, dict())
+        if page.get('etag'):
+            headers['If-None-Match'] = page['etag']
+        if page.get('last_modified'):
+            headers['If-Modified-Since'] = page['last_modified']
+        return headers
+
+    def record_page(self, url, response):
+        '''
+        Records validators and a content hash for a successful response.
+        Returns False if the content is identical to the last recorded
+        content, which covers servers that ignore conditional requests.
+        '''
+        digest = hashlib.sha256(response.content).hexdigest()
+        page = self.pages.setdefault(url, dict())
+        changed = page.get('sha256') != digest
+        page['etag'] = response.headers.get('ETag')
+        page['last_modified'] = response.headers.get('Last-Modified')
+        page['sha256'] = digest
+        return changed
+
+    def path_for(self, url):
+        '''
+        Returns the file a URL's content was last written to, if any.
+        '''
+        path = self.pages.get(url, dict()).get('path')
+        if path is None:
+            return None
+        return Path(path)
+
+    def write_if_changed(self, path, data, url=None):
+        '''
+        Writes data to path unless the file already holds exactly these
+        bytes. Returns True if the file was written.
+        '''
+        key = str(path)
+        digest = hashlib.sha256(data).hexdigest()
+        if url is not None:
+            self.pages.setdefault(url, dict())['path'] = key
+        if key not in self.files and path.exists():
+            # seed from disk so a first incremental run doesn't rewrite all
+            self.files[key] = hashlib.sha256(path.read_bytes()).hexdigest()
+        if self.files.get(key) == digest and path.exists():
+            count('scrape.images_unchanged')
+            return False
+        # the watcher and the display never see a half-written image
+        with span('scrape.write_image', path=key):
+            atomic_write(path, data)
+        count('scrape.images_written')
+        self.files[key] = digest
+        return True
+
+
+class ScrapeDelta():
+    '''
+    Difference between a branch's precedence before and after a scrape.
+    '''
+    def __init__(self, old, new):
+        old_ranks = {name: precedence for precedence, name in old.items()}
+        new_ranks = {name: precedence for precedence, name in new.items()}
+        self.added = [name for precedence, name in sorted(new.items())
+                      if name not in old_ranks]
+        self.removed = [name for precedence, name in sorted(old.items())
+                        if name not in new_ranks]
+        self.reordered = [name for precedence, name in sorted(new.items())
+                          if name in old_ranks and
+                          old_ranks[name] != precedence]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.reordered)
+
+    def __str__(self):
+        if not self:
+            return "no changes"
+        return "{} added, {} removed, {} reordered".format(
+            len(self.added), len(self.removed), len(self.reordered))
+
+    def __repr__(self):
+        return "ScrapeDelta(added={}, removed={}, reordered={})".format(
+            self.added, self.removed, self.reordered)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+'''
+Named rack profiles: saved sets of ribbon IDs per branch, so a rack can be
+restored or switched in one step instead of selecting ribbons one by one.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import json
+from pathlib import Path
+
+from ribbonfiles import atomic_write
+
+
+class RackProfiles():
+    '''
+    {branch: {profile name: [ribbon ID]}}, kept in memory once loaded so
+    switching profiles never touches the disk. Stored as JSON next to the
+    precedence file.
+    '''
+    def __init__(self, location):
+        self.location = Path(location)
+        self.profiles = dict()
+
+    def load(self):
+        '''
+        Loads profiles from disk. A missing or unreadable file just means no
+        profiles have been saved yet.
+        '''
+        try:
+            with self.location.open('r') as filepath:
+                self.profiles = json.load(filepath)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self.profiles = dict()
+
+    def store(self):
+        '''
+        Writes profiles atomically, so an interrupted write never loses the
+        saved profiles.
+        '''
+        self.location.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.location, json.dumps(
+            self.profiles, sort_keys=True, indent=4,
+            separators=(',', ': ')).encode('utf-8'))
+
+    def names(self, branch):
+        '''
+        Returns the names of a branch's profiles, sorted.
+        '''
+        return sorted(self.profiles.get(branch, dict()))
+
+    def get(self, branch, name):
+        '''
+        Returns the ribbon IDs of a profile.
+        '''
+        return self.profiles[branch][name]
+
+    def save(self, branch, name, ribbon_ids):
+        '''
+        Saves a profile, replacing any profile of the same name, and stores
+        all profiles.
+        '''
+        self.profiles.setdefault(branch, dict())[name] = sorted(ribbon_ids)
+        self.store()
+
+    def delete(self, branch, name):
+        '''
+        Deletes a profile and stores the remaining ones.
+        '''
+        del self.profiles[branch][name]
+        if not self.profiles[branch]:
+            del self.profiles[branch]
+        self.store()
@@ -6,41 +6,71 @@ Author: Alden Davidson, adavidson@protonmail.ch
 Date: Summer 2019
 '''
 
+import argparse
 import json
+import multiprocessing
 import sys
 # this fixes PATH so binaries build on Windows
 import _append_run_path # pylint: disable=unused-import
 
 from PyQt5.QtWidgets import ( # pylint: disable=wrong-import-order
     QApplication,
+    QComboBox,
+    QHBoxLayout,
+    QInputDialog,
     QMainWindow,
+    QProgressBar,
+    QPushButton,
     QTabWidget,
     QVBoxLayout,
     QWidget
 )
 from PyQt5.QtCore import ( # pylint: disable=wrong-import-order
-        Qt
+        pyqtSlot,
+        Qt,
+        QThread
 )
 
+from ribbonatlas import atlas_path, build_atlas
 from ribbondisplay import RibbonDisplay
+from ribbonimages import RibbonImageCache, ScaledRibbonCache, ThumbnailCache
+from ribbonprofiles import RackProfiles
 from ribbons import Ribbons
-from ribbonscraper import RibbonScraper
 from ribbonselector import RibbonSelector
+from ribbonwatcher import RibbonWatcher
 
 
 class RackWidget(QWidget):
     '''
-    Central widget for managing selector, displayer, etc.
+    Central widget for managing selector, displayer, profiles, etc.
     '''
-    def __init__(self, branch, ribbons):
+    def __init__(self, branch, ribbons, profiles, canvas=False):
         super().__init__()
+        self.branch = branch
+        self.ribbons = ribbons
+        self.profiles = profiles
         self.layout = QVBoxLayout()
-        self.display = RibbonDisplay(branch)
-        self.selector = RibbonSelector(ribbons)
+        self.display = RibbonDisplay(branch, ribbons, canvas)
+        self.selector = RibbonSelector(ribbons.catalog(branch))
+        self.profile_box = QComboBox()
+        self.save_button = QPushButton("Save profile")
+        self.delete_button = QPushButton("Delete profile")
+        self.init_ui()
+        self.connect_ui()
+
+    def init_ui(self):
+        '''
+        Helper function to manage all widget placement
+        '''
+        profile_layout = QHBoxLayout()
+        profile_layout.addWidget(self.profile_box, 1)
+        profile_layout.addWidget(self.save_button)
+        profile_layout.addWidget(self.delete_button)
         self.layout.addWidget(self.display)
+        self.layout.addLayout(profile_layout)
         self.layout.addWidget(self.selector)
         self.setLayout(self.layout)
-        self.connect_ui()
+        self.refresh_profiles()
 
     def connect_ui(self):
         '''
@@ -48,50 +78,305 @@ class RackWidget(QWidget):
         '''
         self.selector.ribbon_added.connect(self.display.add_ribbon)
         self.selector.ribbon_removed.connect(self.display.remove_ribbon)
+        self.selector.selection_replaced.connect(self.display.set_ribbons)
+        self.profile_box.activated[str].connect(self.load_profile)
+        self.save_button.clicked.connect(self.save_profile)
+        self.delete_button.clicked.connect(self.delete_profile)
+
+    def reload(self, changed_ids=()):
+        '''
+        Applies a rebuilt catalog to the selector and display, keeping the
+        current selection. changed_ids are ribbons whose images changed.
+        '''
+        catalog = self.ribbons.catalog(self.branch)
+        self.selector.reload(catalog, changed_ids)
+        self.display.reload(changed_ids)
+
+    def refresh_profiles(self, current=None):
+        '''
+        Refills the profile list, showing the given profile as current.
+        '''
+        self.profile_box.clear()
+        self.profile_box.addItems(self.profiles.names(self.branch))
+        if current is None:
+            self.profile_box.setCurrentIndex(-1)
+        else:
+            self.profile_box.setCurrentText(current)
+        self.delete_button.setEnabled(self.profile_box.count() > 0)
+
+    @pyqtSlot(str)
+    def load_profile(self, name):
+        '''
+        Applies a saved profile to the rack in one bulk operation.
+        '''
+        self.selector.set_selection(self.profiles.get(self.branch, name))
+
+    @pyqtSlot()
+    def save_profile(self):
+        '''
+        Saves the current rack under a name chosen by the user.
+        '''
+        name, accepted = QInputDialog.getText(
+            self, "Save profile", "Profile name:",
+            text=self.profile_box.currentText())
+        name = name.strip()
+        if not accepted or not name:
+            return
+        self.profiles.save(self.branch, name, self.selector.model.selected_ids())
+        self.refresh_profiles(name)
+
+    @pyqtSlot()
+    def delete_profile(self):
+        '''
+        Deletes the current profile. The rack itself is left as it is.
+        '''
+        name = self.profile_box.currentText()
+        if name in self.profiles.names(self.branch):
+            self.profiles.delete(self.branch, name)
+        self.refresh_profiles()
 
 
 class MainWindow(QMainWindow):
     '''
     MainWindow controls display of application.
     '''
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, canvas=False):
         super(MainWindow, self).__init__(parent)
+        self.canvas = canvas
 
         # window options
         self.setWindowTitle("RibbonRack")
         self.resize(1280, 700)
-        # initialize ribbon tools
-        self.scraper = RibbonScraper()
+        # initialize ribbon tools; the scraper is only created if needed
+        self.scraper = None
         self.ribbons = Ribbons()
-        self.init_ribbons()
+        self.profiles = RackProfiles(self.ribbons.profile_location)
+        self.profiles.load()
+        self.scrape_thread = None
+        self.scrape_worker = None
+        self.progress_bar = None
+        self.cancel_button = None
+        loaded = self.init_ribbons()
         # initialize main widget
         self.rack_stack = QTabWidget()
         self.rack_stack.setMovable(True)
+        self.racks = dict()
         self.init_racks()
         self.setCentralWidget(self.rack_stack)
+        if not loaded:
+            self.start_scrape()
+        self.build_rack(self.rack_stack.currentIndex())
+        self.rack_stack.currentChanged.connect(self.build_rack)
+        # pick up stored data changed by anything else while running
+        self.watcher = RibbonWatcher(self.ribbons)
+        self.watcher.json_changed.connect(self.on_json_changed)
+        self.watcher.precedence_changed.connect(self.on_precedence_changed)
+        self.watcher.images_changed.connect(self.on_images_changed)
 
     def init_racks(self):
         '''
-        Initializes all the "racks" available to the user, which are what
-        display ribbons and the selection systems for each branch.
+        Initializes a tab for each of the "racks" available to the user, which
+        are what display ribbons and the selection systems for each branch.
+        Each tab starts out empty and is filled in by build_rack when it's
+        first shown.
+        '''
+        for branch in ("USAF", "AFROTC"):
+            page = QWidget()
+            page.setLayout(QVBoxLayout())
+            page.layout().setContentsMargins(0, 0, 0, 0)
+            self.rack_stack.addTab(page, branch)
+
+    @pyqtSlot(int)
+    def build_rack(self, index):
+        '''
+        Builds the rack for a tab the first time it's shown, and starts
+        decoding its ribbon images in the background.
         '''
-        usaf_rack = RackWidget("USAF", self.ribbons.precedence['USAF'])
-        afrotc_rack = RackWidget("AFROTC", self.ribbons.precedence['AFROTC'])
-        self.rack_stack.addTab(usaf_rack, "USAF")
-        self.rack_stack.addTab(afrotc_rack, "AFROTC")
+        branch = self.rack_stack.tabText(index)
+        if index < 0 or branch in self.racks:
+            return
+        self.racks[branch] = RackWidget(branch, self.ribbons, self.profiles,
+                                        self.canvas)
+        self.rack_stack.widget(index).layout().addWidget(self.racks[branch])
+        if self.scrape_thread is None:
+            RibbonImageCache.instance().prewarm(self.ribbons.catalog(branch))
 
     def init_ribbons(self):
         '''
-        Initializes ribbon information, and scrapes all if information is not
-        already stored.
+        Initializes ribbon information from storage. Returns False if there
+        is no usable stored information, in which case everything needs to
+        be scraped.
         '''
         try:
             self.ribbons.load_precedence()
         except (FileNotFoundError, json.decoder.JSONDecodeError):
-            print("Scraping and storing all ribbons")
-            self.scraper.scrape(self.ribbons, 'all')
+            return False
+        return True
+
+    def start_scrape(self):
+        '''
+        Scrapes all ribbons on a background thread. Ribbons are added to the
+        racks as they arrive, and a progress bar with a cancel button is
+        shown in the status bar until the scrape ends.
+        '''
+        # the scraping stack is only imported when it's actually needed
+        from ribbonscraper import RibbonScraper  # pylint: disable=import-outside-toplevel
+        from ribbonworker import ScrapeWorker  # pylint: disable=import-outside-toplevel
+        print("Scraping and storing all ribbons")
+        if self.scraper is None:
+            self.scraper = RibbonScraper()
+        self.scrape_thread = QThread(self)
+        self.scrape_worker = ScrapeWorker(self.scraper, self.ribbons)
+        self.scrape_worker.moveToThread(self.scrape_thread)
+        # progress display
+        self.progress_bar = QProgressBar()
+        self.cancel_button = QPushButton("Cancel")
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        # connections
+        self.scrape_thread.started.connect(self.scrape_worker.run)
+        self.scrape_worker.ribbon_scraped.connect(self.on_ribbon_scraped)
+        self.scrape_worker.progress.connect(self.on_scrape_progress)
+        self.scrape_worker.finished.connect(self.on_scrape_finished)
+        self.scrape_worker.failed.connect(self.on_scrape_failed)
+        self.scrape_worker.cancelled.connect(self.on_scrape_cancelled)
+        self.cancel_button.clicked.connect(self.scrape_worker.cancel)
+        self.scrape_thread.start()
+
+    def stop_scrape(self, message):
+        '''
+        Tears down the scrape thread and progress display.
+        '''
+        if self.scrape_thread is None:
+            # already torn down by closeEvent
+            return
+        self.scrape_thread.quit()
+        self.scrape_thread.wait()
+        self.statusBar().removeWidget(self.progress_bar)
+        self.statusBar().removeWidget(self.cancel_button)
+        self.progress_bar.deleteLater()
+        self.cancel_button.deleteLater()
+        self.scrape_thread = None
+        self.scrape_worker = None
+        self.statusBar().showMessage(message, 5000)
+
+    @pyqtSlot(str, int, str)
+    def on_ribbon_scraped(self, branch, precedence, ribbon):
+        '''
+        Adds a freshly scraped ribbon to its branch's rack.
+        '''
+        if branch not in self.racks:
+            # built from the catalog once its tab is shown
+            return
+        record = self.ribbons.catalog(branch).by_name[ribbon]
+        self.racks[branch].selector.add_master_ribbon(record)
+
+    @pyqtSlot(str, int, int)
+    def on_scrape_progress(self, branch, count, total):
+        '''
+        Updates the progress display.
+        '''
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(count)
+        self.statusBar().showMessage("Scraping " + branch)
+
+    @pyqtSlot()
+    def on_scrape_finished(self):
+        '''
+        Stores the scraped ribbons once every branch is done.
+        '''
+        self.ribbons.store_precedence()
+        self.stop_scrape("Scraped all ribbons")
+
+    @pyqtSlot(str)
+    def on_scrape_failed(self, error):
+        '''
+        Reports a failed scrape. Nothing is stored, so the next launch scrapes
+        again.
+        '''
+        print("Scraping failed: " + error)
+        self.stop_scrape("Scraping failed: " + error)
+
+    @pyqtSlot()
+    def on_scrape_cancelled(self):
+        '''
+        Reports a cancelled scrape. Nothing is stored, so the next launch
+        scrapes again.
+        '''
+        self.stop_scrape("Scraping cancelled")
+
+    @pyqtSlot()
+    def on_json_changed(self):
+        '''
+        Imports an edited precedence.json into the store, which in turn is
+        picked up by on_precedence_changed.
+        '''
+        if self.scrape_thread is not None:
+            return
+        try:
+            self.ribbons.import_json()
             self.ribbons.store_precedence()
+        except (FileNotFoundError, json.decoder.JSONDecodeError,
+                RuntimeError) as error:
+            print("Ignoring changed precedence.json: " + str(error))
+            # keep using what's in the store
+            self.ribbons.load_precedence()
+
+    @pyqtSlot()
+    def on_precedence_changed(self):
+        '''
+        Reloads precedence from the store and re-ranks the built racks.
+        Ignored while scraping, since the scrape streams its ribbons in.
+        '''
+        if self.scrape_thread is not None:
+            return
+        try:
             self.ribbons.load_precedence()
+        except (FileNotFoundError, json.decoder.JSONDecodeError) as error:
+            print("Couldn't reload precedence: " + str(error))
+            return
+        for rack in self.racks.values():
+            rack.reload()
+        self.statusBar().showMessage("Reloaded ribbon precedence", 5000)
+
+    @pyqtSlot(str, list)
+    def on_images_changed(self, branch, filenames):
+        '''
+        Drops cached images of changed ribbon images and refreshes the ones
+        shown in the branch's rack.
+        '''
+        if self.scrape_thread is not None:
+            return
+        # the atlas is read in preference to the image files, so it's
+        # repacked before the changed images are dropped from the caches;
+        # repacking changes the atlas, which is reported with no filenames
+        if filenames and atlas_path(self.ribbons.image_location,
+                                    branch).exists():
+            build_atlas(self.ribbons.image_location, branch)
+        # the catalog resolves image paths, which may have changed too
+        self.ribbons.catalogs.pop(branch, None)
+        RibbonImageCache.instance().reopen_atlas(branch)
+        filenames = set(filenames)
+        changed = [record for record in self.ribbons.catalog(branch)
+                   if record.path.stem in filenames]
+        for record in changed:
+            RibbonImageCache.instance().invalidate(record)
+            ScaledRibbonCache.instance().invalidate(record.ribbon_id)
+            ThumbnailCache.instance().invalidate(record)
+        if branch in self.racks:
+            self.racks[branch].reload(
+                [record.ribbon_id for record in changed])
+
+    def closeEvent(self, event):  # pylint: disable=invalid-name
+        '''
+        Cancels any running scrape and waits for its thread before closing.
+        '''
+        if self.scrape_thread is not None:
+            self.scrape_worker.cancel()
+            self.scrape_thread.quit()
+            self.scrape_thread.wait()
+            self.scrape_thread = None
+        super(MainWindow, self).closeEvent(event)
 
     def keyPressEvent(self, event):  # pylint: disable=invalid-name
         '''
@@ -105,7 +390,20 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
-    APP = QApplication(sys.argv)
-    ROOT = MainWindow()
+    # in bundled binaries, lets the scraper's ingest workers start without
+    # relaunching the application
+    multiprocessing.freeze_support()
+    if sys.argv[1:2] == ["serve"]:
+        # headless; see ribbonserver.py for its options
+        import ribbonserver  # pylint: disable=import-outside-toplevel
+        ribbonserver.main(sys.argv[2:])
+        sys.exit()
+    PARSER = argparse.ArgumentParser(description="Build your ribbon rack.")
+    PARSER.add_argument('--canvas', action='store_true',
+                        help="paint each rack as a single canvas widget")
+    # anything unrecognized is left for Qt
+    ARGS, QT_ARGS = PARSER.parse_known_args()
+    APP = QApplication(sys.argv[:1] + QT_ARGS)
+    ROOT = MainWindow(canvas=ARGS.canvas)
     ROOT.show()
     sys.exit(APP.exec_())
@@ -7,12 +7,26 @@ Author: Alden Davidson, adavidsno@protonmail.ch
 Date: Summer 2019
 '''
 
-import collections
-import copy
 from pathlib import Path
 import platform
 import json
 
+from ribboncatalog import RibbonCatalog
+from ribbonfiles import atomic_write
+from ribbonstore import LazyPrecedence, PrecedenceStore, StoreError
+from ribbontrace import span
+
+# number of ribbons in each row of a rack
+RACK_WIDTH = 3
+
+
+def scale_bucket(scale):
+    '''
+    Snaps a zoom factor to the nearest quarter step between 0.25 and 4, so
+    that a handful of variants cover every zoom level.
+    '''
+    return min(max(round(scale * 4) / 4, 0.25), 4.0)
+
 
 class Ribbons():
     '''
@@ -20,7 +34,7 @@ class Ribbons():
     '''
     def __init__(self):
         self.branches = set(["USAF", "AFROTC"])
-        self.precedence = collections.defaultdict(dict)
+        self.precedence = LazyPrecedence()
         if platform.system() == 'Linux':
             self.info_location = Path.home().joinpath(Path('.ribbonrack/precedence.json'))
             self.image_location = Path.home().joinpath(Path('.ribbonrack/images/'))
@@ -29,42 +43,88 @@ class Ribbons():
             self.image_location = Path('./ribbonrack_data/images/')
         else:
             raise RuntimeError("Operation system not supported.")
-            
+        self.manifest_location = self.info_location.with_name('manifest.json')
+        self.store_location = self.info_location.with_name('precedence.bin')
+        self.thumbnail_location = self.image_location.joinpath('thumbnails')
+        self.profile_location = self.info_location.with_name('profiles.json')
+        self.catalogs = dict()
+
+    def catalog(self, branch):
+        '''
+        Returns the RibbonCatalog for a branch. It's built on first use and
+        rebuilt only when the branch's precedence has changed size, e.g.
+        while ribbons are still being scraped.
+        '''
+        count, catalog = self.catalogs.get(branch, (None, None))
+        if count != len(self.precedence[branch]):
+            # copy first; a background scrape may still be adding ribbons
+            precedence = dict(self.precedence[branch])
+            catalog = RibbonCatalog(branch, precedence, self.image_location)
+            self.catalogs[branch] = (len(catalog), catalog)
+        return catalog
 
     def store_precedence(self):
         '''
-        Stores current ribbon precedence information in a pretty JSON file.
-        Does not check if there's actual ribbon info in self.precedence.
+        Stores current ribbon precedence information in the binary store,
+        atomically replacing any previous version.
         '''
-        self.info_location.touch()
-        if self.precedence:
-            jsonable_precedence = dict(self.precedence)
-            with self.info_location.open('w') as filepath:
-                json.dump(jsonable_precedence, filepath,
-                          sort_keys=True, indent=4, separators=(',', ': '))
+        self.precedence.load_all()
+        if any(self.precedence.values()):
+            with span('precedence.store'):
+                PrecedenceStore.write(self.store_location, self.precedence)
         else:
             raise RuntimeError(
                 "Precedence is empty. Try loading or scraping it instead.")
 
     def load_precedence(self):
         '''
-        Loads ribbon precedence information from a JSON file.
+        Opens the binary precedence store. Branches are only read when first
+        accessed. If there's no store yet, or it's damaged or from an
+        incompatible schema version, precedence is imported from the JSON
+        file instead and written to a new store.
+        '''
+        try:
+            with span('precedence.open_store'):
+                store = PrecedenceStore(self.store_location)
+        except (FileNotFoundError, StoreError) as error:
+            if isinstance(error, StoreError):
+                print(str(error) + ". Importing from JSON instead.")
+            self.import_json()
+            self.store_precedence()
+            return
+        self.precedence = LazyPrecedence(store)
+        self.catalogs = dict()
+
+    def import_json(self, path=None):
+        '''
+        Loads ribbon precedence information from a JSON file, by default the
+        precedence.json next to the store.
         '''
+        path = Path(path) if path is not None else self.info_location
         try:
-            with self.info_location.open('r') as filepath:
-                self.precedence = json.load(filepath)
-            # convert back into default dict
-            self.precedence = collections.defaultdict(dict, self.precedence)
-            # convert keys back to ints
-            newdict = collections.defaultdict(dict)
-            for branch, ribbons in self.precedence.items():
-                for precedence in ribbons.keys():
-                    newdict[branch][int(precedence)] = \
-                        self.precedence[branch][precedence]
-            self.precedence = copy.deepcopy(newdict)
+            with span('precedence.import_json'), path.open('r') as filepath:
+                precedence = json.load(filepath)
         except FileNotFoundError:
             print("Precedence file doesn't exist")
             raise
         except json.decoder.JSONDecodeError:
             print("Issue with JSON file. Try loading or scraping it again.")
             raise
+        self.precedence = LazyPrecedence()
+        for branch, ribbons in precedence.items():
+            # JSON keys are always strings
+            self.precedence[branch] = {
+                int(rank): name for rank, name in ribbons.items()}
+        self.catalogs = dict()
+
+    def export_json(self, path=None):
+        '''
+        Writes current ribbon precedence information to a pretty JSON file,
+        by default the precedence.json next to the store.
+        '''
+        path = Path(path) if path is not None else self.info_location
+        self.precedence.load_all()
+        with span('precedence.export_json'):
+            atomic_write(path, json.dumps(
+                dict(self.precedence), sort_keys=True, indent=4,
+                separators=(',', ': ')).encode('utf-8'))
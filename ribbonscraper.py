@@ -9,83 +9,289 @@ Author: Alden Davidson, adavidson@protonmail.ch
 Date: Summer 2019
 '''
 
-import base64
-import imghdr
+import binascii
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import json
 from pathlib import Path
+import shutil
+import threading
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import lxml # imported to ensure inclusion in binaries
 import requests
+from requests.adapters import HTTPAdapter
 from titlecase import titlecase
+from urllib3.util.retry import Retry
+
+from ribbonatlas import build_atlas
+from ribboncatalog import sanitize_filename
+from ribboningest import (
+    BATCH_SIZE,
+    INGEST_SUFFIX,
+    InvalidImageError,
+    RibbonIngest
+)
+from ribbonmanifest import ScrapeDelta, ScrapeManifest
+from ribbons import Ribbons
+from ribbontrace import span
+
+
+class ScrapeCancelled(Exception):
+    '''
+    Raised inside a scrape once RibbonScraper.cancel() has been called.
+    '''
 
 
 class RibbonScraper():
     '''
     Scrapes and stores information about ribbons from websites.
     '''
-    def __init__(self):
+    def __init__(self, max_workers=8, per_host_limit=4, retries=3,
+                 backoff=0.5):
         self.urls = dict(
             USAF="https://www.afpc.af.mil/Recognition/Decorations-and-Ribbons/",  # noqa: E501
             # unofficial source, cannot find official that's scrapeable
             AFROTC="http://patriotfiles.com/forum/showthread.php?t=116789"
         )
+        # id of the element holding the ribbon table on each page
+        self.containers = dict(
+            USAF="dnn_ctr25862_HtmlModule_lblContent",
+            AFROTC="post_message_445047"
+        )
+        self.max_workers = max_workers
+        self.session = self.create_session(per_host_limit, retries, backoff)
+        self.manifest = None
+        self.incremental = False
+        self.on_ribbon = None
+        self.cancel_event = threading.Event()
+        self.ingest = None
+
+    @staticmethod
+    def create_session(per_host_limit, retries, backoff):
+        '''
+        Creates a keep-alive session shared by every request the scraper
+        makes. The connection pool blocks once per_host_limit connections to
+        a single host are in use, which caps concurrency per host regardless
+        of how many workers are fetching.
+        '''
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_maxsize=per_host_limit, pool_block=True,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
-    def get_soup(self, branch):
+    def fetch_image(self, url):
         '''
-        Helper to create the soup for a branch.
+        Downloads a single image through the shared session. In incremental
+        mode a conditional request is sent, and None is returned if the
+        server reports the image as unchanged.
+        '''
+        headers = dict()
+        if self.incremental:
+            headers = self.manifest.conditional_headers(url)
+        with span('scrape.get_image', url=url):
+            response = self.session.get(url, headers=headers)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        self.manifest.record_page(url, response)
+        return response.content
+
+    def get_soup(self, branch, conditional=False):
+        '''
+        Helper to create the soup for a branch. If conditional is set, returns
+        None when the page hasn't changed since the last recorded scrape.
         '''
         url = self.urls[branch]
-        page = requests.get(url)
+        headers = dict()
+        if conditional:
+            headers = self.manifest.conditional_headers(url)
+        with span('scrape.get_page', url=url):
+            page = self.session.get(url, headers=headers)
+        if page.status_code == 304:
+            return None
         # check for any 404s (or other errors) before using content
         page.raise_for_status()
-        soup = BeautifulSoup(page.content, 'lxml')
-        return soup
+        changed = self.manifest.record_page(url, page)
+        if conditional and not changed:
+            return None
+        return self.parse_soup(branch, page.content)
+
+    def parse_soup(self, branch, content):
+        '''
+        Parses only the element containing a branch's ribbon table. The rest
+        of the page is skipped by the parser instead of being built into the
+        tree, which keeps both parse time and memory down.
+        '''
+        strainer = SoupStrainer('div', id=self.containers[branch])
+        with span('scrape.parse', branch=branch):
+            return BeautifulSoup(content, 'lxml', parse_only=strainer)
+
+    @staticmethod
+    def decode_data_uri(source):
+        '''
+        Decodes the base64 payload of an inline data URI. The payload is
+        sliced from a memoryview, so the (large) string is only copied once
+        when encoding it to bytes.
+        '''
+        start = source.find('base64,')
+        start = 0 if start < 0 else start + len('base64,')
+        return binascii.a2b_base64(memoryview(source.encode('ascii'))[start:])
+
+    def ingester(self):
+        '''
+        The process pool normalizing scraped images, started on first use.
+        '''
+        if self.ingest is None:
+            self.ingest = RibbonIngest()
+        return self.ingest
+
+    def store_image(self, folderpath, name, image, url=None):
+        '''
+        Writes a ribbon's image as normalized by the ingest pool. Images that
+        failed verification (an InvalidImageError in place of the data) are
+        reported and not written.
+        '''
+        if isinstance(image, InvalidImageError):
+            print("Skipping invalid image for " + name + ": " + str(image))
+            return
+        filepath = folderpath.joinpath(sanitize_filename(name) +
+                                       INGEST_SUFFIX)
+        self.manifest.write_if_changed(filepath, image, url)
+
+    @staticmethod
+    def remove_stale_images(folderpath):
+        '''
+        Removes images stored in another format, e.g. by scrapes from before
+        images were normalized, once the ribbon's normalized image exists.
+        '''
+        paths = [path for path in folderpath.iterdir() if path.is_file()]
+        normalized = {path.stem for path in paths
+                      if path.suffix == INGEST_SUFFIX}
+        for path in paths:
+            if path.suffix != INGEST_SUFFIX and path.stem in normalized:
+                path.unlink()
 
-    def scrape(self, ribbons, branch):
+    def cancel(self):
+        '''
+        Requests that a running scrape stop at the next ribbon. Safe to call
+        from any thread.
+        '''
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        '''
+        Raises ScrapeCancelled if cancellation has been requested.
+        '''
+        if self.cancel_event.is_set():
+            raise ScrapeCancelled()
+
+    def add_ribbon(self, ribbons, branch, precedence, name, total):
+        '''
+        Records a scraped ribbon and reports it to the on_ribbon callback, if
+        any, as (branch, precedence, name, total).
+        '''
+        self.check_cancelled()
+        ribbons.precedence[branch][precedence] = name
+        if self.on_ribbon is not None:
+            self.on_ribbon(branch, precedence, name, total)
+
+    def scrape(self, ribbons, branch, incremental=False, on_ribbon=None):
         '''
         Wrapper function to select branch to scrape. Can scrape all if "all"
-        is passed in as branch.
-        '''
-        if any(x is branch for x in ribbons.branches):
-            soup = self.get_soup(branch)
-            folderpath = Path(
-                ribbons.image_location).joinpath(branch + "/")
-            folderpath.mkdir(parents=True, exist_ok=True)
-            if branch == "USAF":
-                print("Scraping USAF at " + self.urls["USAF"])
-                self.scrape_usaf(ribbons, soup, folderpath)
-            elif branch == "AFROTC":
-                print("Scraping AFROTC at " + self.urls["AFROTC"])
-                self.scrape_afrotc(ribbons, soup, folderpath)
+        is passed in as branch. In incremental mode, pages and images that
+        haven't changed since the last scrape are neither downloaded nor
+        rewritten. on_ribbon is called with each ribbon as soon as it's
+        scraped. Returns a ScrapeDelta for each scraped branch.
+        '''
+        if branch in ribbons.branches:
+            branches = [branch]
         elif branch == "all":
-            for branches in ribbons.branches:
-                self.scrape(ribbons, branches)
+            branches = sorted(ribbons.branches)
         else:
             raise NotImplementedError(
                 branch +
                 ' is either invalid or unimplemented. Valid options are all, '
-                + ribbons.branches)
+                + ', '.join(sorted(ribbons.branches)))
+        self.manifest = ScrapeManifest(ribbons.manifest_location)
+        self.incremental = incremental
+        self.on_ribbon = on_ribbon
+        self.cancel_event.clear()
+        if incremental:
+            self.manifest.load()
+        deltas = dict()
+        try:
+            for name in branches:
+                with span('scrape.branch', branch=name):
+                    deltas[name] = self.scrape_branch(ribbons, name)
+        finally:
+            self.manifest.store()
+            if self.ingest is not None:
+                self.ingest.shutdown(cancel=self.cancel_event.is_set())
+                self.ingest = None
+        return deltas
+
+    def scrape_branch(self, ribbons, branch):
+        '''
+        Scrapes a single branch, replacing its precedence information.
+        '''
+        self.check_cancelled()
+        old_precedence = dict(ribbons.precedence[branch])
+        # a page is only skipped if there's precedence to fall back on
+        conditional = self.incremental and bool(old_precedence)
+        soup = self.get_soup(branch, conditional)
+        if soup is None:
+            print(branch + " unchanged at " + self.urls[branch])
+            for precedence, name in sorted(old_precedence.items()):
+                self.add_ribbon(ribbons, branch, precedence, name,
+                                len(old_precedence))
+            return ScrapeDelta(old_precedence, old_precedence)
+        folderpath = Path(
+            ribbons.image_location).joinpath(branch + "/")
+        folderpath.mkdir(parents=True, exist_ok=True)
+        ribbons.precedence[branch] = dict()
+        if branch == "USAF":
+            print("Scraping USAF at " + self.urls["USAF"])
+            self.scrape_usaf(ribbons, soup, folderpath)
+        elif branch == "AFROTC":
+            print("Scraping AFROTC at " + self.urls["AFROTC"])
+            self.scrape_afrotc(ribbons, soup, folderpath)
+        self.remove_stale_images(folderpath)
+        build_atlas(ribbons.image_location, branch)
+        # thumbnails are recreated from the new images when next needed
+        shutil.rmtree(str(ribbons.thumbnail_location.joinpath(branch)),
+                      ignore_errors=True)
+        # names and image files may have changed
+        ribbons.catalogs.pop(branch, None)
+        return ScrapeDelta(old_precedence, ribbons.precedence[branch])
 
     def scrape_usaf(self, ribbons, soup, folderpath):
-        # pylint: disable=no-self-use
         '''
-        Scrapes the information from USAF AFPC ribbons page.
+        Scrapes the information from USAF AFPC ribbons page. Decoded images
+        are handed to the ingest pool in batches, and parsing moves on while
+        they're normalized; ribbons are stored, in order of precedence, as
+        their batches come back.
         '''
-        rows = soup.find(lambda tag:
-                         tag.name == 'div' and
-                         tag.has_attr('id') and
-                         tag['id'] == "dnn_ctr25862_HtmlModule_lblContent"
-                         ).findAll('tr')
+        container = soup.find('div', id=self.containers["USAF"])
+        rows = container.findAll('tr')
+        total = len(container.findAll('img'))
+        ingest = self.ingester()
+        # (ribbon names, future of their normalized images), in order
+        pending = collections.deque()
+        names = []
+        images = []
         precedence = 0
         for row in rows:
             for ribbon in row.findAll('td'):
                 ribbon_image_container = ribbon.find('img')
                 if ribbon_image_container:
                     # image data is stored directly in HTML as base64 string
-                    ribbon_image_data = base64.b64decode(
-                        ribbon_image_container['src'].split('base64,', 1)[-1])
-                    # get filetype from image data, since HTML is unreliable
-                    ribbon_filetype = imghdr.what("", ribbon_image_data)
+                    images.append(self.decode_data_uri(
+                        ribbon_image_container['src']))
                     # isolate ribbon name
                     ribbon_name = ribbon.find('a').find('span').contents[0]
                     # Some ribbons have title text all screwed up, and can
@@ -96,44 +302,108 @@ class RibbonScraper():
                             ribbon_image_container['alt'].lower())
                     if '(' in ribbon_name:
                         ribbon_name = ribbon_name.split('(')[0].strip()
-                    # sanitize name for use as filename
-                    ribbon_filename = ribbon_name.replace(" ", "")
-                    ribbon_filename = ribbon_filename.replace("'", "")
-                    # build filepath to save ribbon image
-                    ribbon_filename = Path(
-                        ribbon_filename + "." + ribbon_filetype)
-                    ribbon_filepath = folderpath.joinpath(ribbon_filename)
-                    ribbon_filepath.write_bytes(ribbon_image_data)
-                    # put ribbon name into list, in order or precendence
-                    ribbons.precedence["USAF"][precedence] = ribbon_name
-                    precedence += 1
+                    names.append(ribbon_name)
+                    if len(images) == BATCH_SIZE:
+                        pending.append((names, ingest.submit(images)))
+                        names = []
+                        images = []
+                    # store whatever is ready without waiting on the rest
+                    while pending and pending[0][1].done():
+                        precedence = self.store_usaf_ribbons(
+                            ribbons, folderpath, precedence, pending.popleft(),
+                            total)
+        if images:
+            pending.append((names, ingest.submit(images)))
+        while pending:
+            precedence = self.store_usaf_ribbons(
+                ribbons, folderpath, precedence, pending.popleft(), total)
+
+    def store_usaf_ribbons(self, ribbons, folderpath, precedence, batch,
+                           total):
+        # pylint: disable=too-many-arguments
+        '''
+        Writes a batch of ingested USAF ribbon images and records the
+        ribbons, returning the next precedence.
+        '''
+        names, ingested = batch
+        for ribbon_name, ribbon_image in zip(names, ingested.result()):
+            self.check_cancelled()
+            self.store_image(folderpath, ribbon_name, ribbon_image)
+            # put ribbon name into list, in order or precendence
+            self.add_ribbon(ribbons, "USAF", precedence, ribbon_name, total)
+            precedence += 1
+        return precedence
 
     def scrape_afrotc(self, ribbons, soup, folderpath):
-        # pylint: disable=no-self-use
         '''
         Scrapes information from a forum post listing all AFROTC ribbons.
         '''
-        rows = soup.find(lambda tag:
-                         tag.name == 'div' and
-                         tag.has_attr('id') and
-                         tag['id'] == 'post_message_445047'
-                         ).table.findAll('tr')
+        rows = soup.find(
+            'div', id=self.containers["AFROTC"]).table.findAll('tr')
         rows = rows[::2]
-        precedence = 0
-        for row in rows:
-            ribbon_name = row.font.text
-            ribbon_name = ribbon_name.replace("*", "")
-            ribbon_image_data = requests.get(row.img['src']).content
-            # determine actual filetype
-            ribbon_filetype = imghdr.what("", ribbon_image_data)
-            # create and sanitize filename
-            ribbon_name_clean = ribbon_name.replace(" ", "")
-            ribbon_name_clean = ribbon_name_clean.replace("/", "")
-            ribbon_name_clean = ribbon_name_clean.replace(".", "")
-            ribbon_filename = Path(ribbon_name_clean + "." + ribbon_filetype)
-            # create full filepath
-            ribbon_filepath = folderpath.joinpath(ribbon_filename)
-            # save image and ribbon name
-            ribbon_filepath.write_bytes(ribbon_image_data)
-            ribbons.precedence["AFROTC"][precedence] = ribbon_name
-            precedence += 1
+        names = [row.font.text.replace("*", "") for row in rows]
+        sources = [row.img['src'] for row in rows]
+        ingest = self.ingester()
+
+        def fetch_and_ingest(url):
+            # the download thread hands the image straight to the ingest
+            # pool and moves on to its next download
+            ribbon_image_data = self.fetch_image(url)
+            if ribbon_image_data is None:
+                return None
+            return ingest.submit([ribbon_image_data])
+
+        # fetch concurrently; map() yields results in submission order, so
+        # images are still written in order of precedence
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            images = executor.map(fetch_and_ingest, sources)
+            try:
+                for precedence, ribbon_image in enumerate(images):
+                    self.store_afrotc_ribbon(
+                        ribbons, folderpath, precedence, names, sources,
+                        ribbon_image)
+            except ScrapeCancelled:
+                # drop queued downloads instead of waiting on them
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def store_afrotc_ribbon(self, ribbons, folderpath, precedence, names,
+                            sources, ribbon_image):
+        # pylint: disable=too-many-arguments
+        '''
+        Writes one downloaded AFROTC ribbon image, given as a future of its
+        ingest (a batch of one) or None if unchanged upstream, and records
+        the ribbon.
+        '''
+        ribbon_name = names[precedence]
+        source = sources[precedence]
+        if ribbon_image is None:
+            # unchanged upstream; keep the previously written file
+            ribbon_filepath = self.manifest.path_for(source)
+            if ribbon_filepath is not None and ribbon_filepath.exists():
+                self.add_ribbon(ribbons, "AFROTC", precedence, ribbon_name,
+                                len(names))
+                return
+            with span('scrape.get_image', url=source):
+                response = self.session.get(source)
+            response.raise_for_status()
+            self.manifest.record_page(source, response)
+            ribbon_image = self.ingester().submit([response.content])
+        self.check_cancelled()
+        self.store_image(folderpath, ribbon_name, ribbon_image.result()[0],
+                         source)
+        self.add_ribbon(ribbons, "AFROTC", precedence, ribbon_name,
+                        len(names))
+
+
+if __name__ == "__main__":
+    # incremental refresh of the stored ribbons, e.g. from a nightly job
+    RIBBONS = Ribbons()
+    try:
+        RIBBONS.load_precedence()
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        pass
+    DELTAS = RibbonScraper().scrape(RIBBONS, 'all', incremental=True)
+    for BRANCH, DELTA in sorted(DELTAS.items()):
+        print(BRANCH + ": " + str(DELTA))
+    RIBBONS.store_precedence()
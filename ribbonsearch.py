@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''
+Type-ahead search over ribbon names. Every word of a name, and the name's
+abbreviation (e.g. "AFAM" for Air Force Achievement Medal), can be matched by
+prefix; longer query words also match anywhere inside a name through a
+trigram index.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import re
+
+# words left out of the short form of an abbreviation
+MINOR_WORDS = frozenset(["a", "an", "and", "for", "in", "of", "on", "the",
+                         "to"])
+EMPTY = frozenset()
+
+
+def abbreviations(words):
+    '''
+    Initials of a name's words, with and without its minor words.
+    '''
+    full = "".join(word[0] for word in words)
+    short = "".join(word[0] for word in words if word not in MINOR_WORDS)
+    return set([full, short]) - set([""])
+
+
+class RibbonSearchIndex():
+    '''
+    Prefix and trigram indexes over catalog records. search() returns
+    matching ribbon IDs in order of precedence; when a query extends the
+    previous one, only the new part is looked up and intersected with the
+    previous results.
+    '''
+    def __init__(self, records=()):
+        self.names = dict()
+        self.ranks = dict()
+        self.prefixes = dict()
+        self.trigrams = dict()
+        self.last_query = None
+        self.last_result = None
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        '''
+        Indexes one ribbon.
+        '''
+        name = self.normalize(record.name)
+        self.names[record.ribbon_id] = name
+        self.ranks[record.ribbon_id] = record.precedence
+        words = re.findall(r"[a-z0-9]+", name)
+        for term in set(words) | abbreviations(words):
+            for end in range(1, len(term) + 1):
+                self.prefixes.setdefault(term[:end], set()).add(
+                    record.ribbon_id)
+        for start in range(len(name) - 2):
+            self.trigrams.setdefault(name[start:start + 3], set()).add(
+                record.ribbon_id)
+        # results of an extended query could now include this ribbon
+        self.last_query = None
+
+    @staticmethod
+    def normalize(text):
+        '''
+        Lowercases text and drops apostrophes, so "airmans" finds "Airman's".
+        '''
+        return text.lower().replace("'", "")
+
+    def match(self, token):
+        '''
+        IDs of ribbons matching a single lowercase query word.
+        '''
+        ids = self.prefixes.get(token, EMPTY)
+        if len(token) < 3:
+            return ids
+        grams = sorted((self.trigrams.get(token[start:start + 3], EMPTY)
+                        for start in range(len(token) - 2)), key=len)
+        candidates = grams[0].intersection(*grams[1:])
+        return ids | set(ribbon_id for ribbon_id in candidates
+                         if token in self.names[ribbon_id])
+
+    def search(self, query):
+        '''
+        Returns the IDs of ribbons matching every word of the query, in order
+        of precedence. An empty query returns None, meaning no filter.
+        '''
+        query = self.normalize(query)
+        tokens = query.split()
+        if not tokens:
+            self.last_query = None
+            return None
+        last_tokens = (self.last_query.split()
+                       if self.last_query is not None else [])
+        if last_tokens and query.startswith(self.last_query) and (
+                len(last_tokens[-1]) >= 3 or
+                tokens[len(last_tokens) - 1] == last_tokens[-1]):
+            # only the last previous word can have grown, and only words
+            # after it can be new, so earlier words' matches still hold.
+            # Words under 3 characters only match by prefix, so one that
+            # grows can gain matches inside names and isn't narrowed.
+            known = len(last_tokens) - 1
+            result = self.last_result
+        else:
+            known = 0
+            result = None
+        for token in tokens[known:]:
+            matches = self.match(token)
+            result = matches if result is None else result & matches
+        self.last_query = query
+        self.last_result = result
+        return sorted(result, key=self.ranks.__getitem__)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 '''
-Lists to select and deselect ribbons to display. Utilizes a subclassed
-QListWidgetItem to enable precedence-based sorting.
+Lists to select and deselect ribbons to display. Both lists are views of a
+single ribbon model: the masterlist shows unselected ribbons and the
+currentlist selected ones, each sorted natively by an integer precedence
+role.
 
 Author: Alden Davidson, adavidson@protonmail.ch
 Date: Summer 2019
@@ -9,77 +11,298 @@ Date: Summer 2019
 
 from PyQt5.QtWidgets import (
     QHBoxLayout,
-    QListWidget,
-    QListWidgetItem,
+    QLineEdit,
+    QListView,
+    QVBoxLayout,
     QWidget
 )
 from PyQt5.QtCore import (
     pyqtSignal,
     pyqtSlot,
-    QItemSelectionModel
+    Qt,
+    QAbstractListModel,
+    QModelIndex,
+    QPoint,
+    QSortFilterProxyModel
 )
 
+from ribbonimages import THUMBNAIL_SIZE, ThumbnailCache
+from ribbonsearch import RibbonSearchIndex
 
-class RibbonListWidgetItem(QListWidgetItem):
+PRECEDENCE_ROLE = Qt.UserRole + 1
+ID_ROLE = Qt.UserRole + 2
+SELECTED_ROLE = Qt.UserRole + 3
+
+
+class RibbonModel(QAbstractListModel):
+    '''
+    Every ribbon of one branch, one row per catalog record, with a flag per
+    row marking whether the ribbon is selected for display. Each row's icon
+    is a thumbnail, loaded in the background the first time it's needed.
+    '''
+    def __init__(self, catalog=()):
+        super().__init__()
+        self.records = list()
+        self.rows = dict()
+        self.selected = bytearray()
+        for record in catalog:
+            self.append(record)
+        ThumbnailCache.instance().thumbnail_ready.connect(
+            self.on_thumbnail_ready)
+
+    def rowCount(self, parent=QModelIndex()):  # pylint: disable=invalid-name
+        '''
+        Number of ribbons; a list model has no children.
+        '''
+        if parent.isValid():
+            return 0
+        return len(self.records)
+
+    def data(self, index, role=Qt.DisplayRole):
+        '''
+        Name, icon, precedence, ID or selection flag of a ribbon.
+        '''
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            return self.records[row].name
+        if role == Qt.DecorationRole:
+            return ThumbnailCache.instance().icon(self.records[row])
+        if role == PRECEDENCE_ROLE:
+            return self.records[row].precedence
+        if role == ID_ROLE:
+            return self.records[row].ribbon_id
+        if role == SELECTED_ROLE:
+            return bool(self.selected[row])
+        return None
+
+    def append(self, record):
+        '''
+        Adds a ribbon as unselected, e.g. while ribbons are still being
+        scraped. Ribbons already in the model are ignored.
+        '''
+        if record.ribbon_id in self.rows:
+            return
+        row = len(self.records)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.records.append(record)
+        self.rows[record.ribbon_id] = row
+        self.selected.append(0)
+        self.endInsertRows()
+
+    def record(self, ribbon_id):
+        '''
+        Returns the catalog record of a ribbon in the model.
+        '''
+        return self.records[self.rows[ribbon_id]]
+
+    def is_selected(self, ribbon_id):
+        '''
+        Whether a ribbon is currently selected.
+        '''
+        return bool(self.selected[self.rows[ribbon_id]])
+
+    def set_selected(self, ribbon_id, selected):
+        '''
+        Flips a ribbon's selection flag. The views' proxies only re-check the
+        changed row, so this moves a single row between the lists. Returns
+        False if the ribbon already had that selection state.
+        '''
+        row = self.rows[ribbon_id]
+        if bool(self.selected[row]) == selected:
+            return False
+        self.selected[row] = int(selected)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [SELECTED_ROLE])
+        return True
+
+    def selected_ids(self):
+        '''
+        Returns the IDs of every selected ribbon.
+        '''
+        return [record.ribbon_id for record, selected
+                in zip(self.records, self.selected) if selected]
+
+    def set_selection(self, ribbon_ids):
+        '''
+        Selects exactly the given ribbons and deselects the rest, announcing
+        the changes per run of changed rows, so each view's proxy only
+        re-filters those rather than every row between the first and last
+        change. IDs not in the model are ignored. Returns the IDs of the
+        selected ribbons.
+        '''
+        selected = bytearray(len(self.records))
+        for ribbon_id in ribbon_ids:
+            row = self.rows.get(ribbon_id)
+            if row is not None:
+                selected[row] = 1
+        previous = self.selected
+        self.selected = selected
+        first = None
+        for row, flag in enumerate(selected):
+            changed = flag != previous[row]
+            if changed and first is None:
+                first = row
+            elif not changed and first is not None:
+                self.dataChanged.emit(self.index(first), self.index(row - 1),
+                                      [SELECTED_ROLE])
+                first = None
+        if first is not None:
+            self.dataChanged.emit(self.index(first),
+                                  self.index(len(selected) - 1),
+                                  [SELECTED_ROLE])
+        return self.selected_ids()
+
+    def update_records(self, catalog):
+        '''
+        Brings the model in line with a rebuilt catalog. Ribbons no longer
+        in it are removed and new ones appended; ribbons whose precedence
+        changed get their new record, announced per run of changed rows so
+        the views' proxies only re-sort those. Selection flags are kept,
+        since ribbon IDs are stable.
+        '''
+        for row in reversed(range(len(self.records))):
+            if self.records[row].ribbon_id not in catalog:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.records[row]
+                del self.selected[row]
+                self.endRemoveRows()
+        self.rows = {record.ribbon_id: row
+                     for row, record in enumerate(self.records)}
+        first = None
+        for row, record in enumerate(self.records):
+            new_record = catalog[record.ribbon_id]
+            self.records[row] = new_record
+            changed = new_record.precedence != record.precedence
+            if changed and first is None:
+                first = row
+            elif not changed and first is not None:
+                self.dataChanged.emit(self.index(first), self.index(row - 1),
+                                      [PRECEDENCE_ROLE])
+                first = None
+        if first is not None:
+            self.dataChanged.emit(self.index(first),
+                                  self.index(len(self.records) - 1),
+                                  [PRECEDENCE_ROLE])
+        for record in catalog:
+            self.append(record)
+
+    @pyqtSlot(int)
+    def on_thumbnail_ready(self, ribbon_id):
+        '''
+        Repaints a ribbon's row once its thumbnail has loaded, or after it
+        was invalidated.
+        '''
+        row = self.rows.get(ribbon_id)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class RibbonFilterModel(QSortFilterProxyModel):
     '''
-    Subclass of QListWidgetItem to support sorting ribbons by precedence
+    Shows either the selected or unselected ribbons of a RibbonModel, sorted
+    by precedence, optionally limited to a set of ribbon IDs.
     '''
-    def __init__(self, ribbon, precedence):
+    def __init__(self, model, selected):
         super().__init__()
-        self.setText(ribbon)
-        self.precedence = precedence
+        self.selected = selected
+        self.visible = None
+        self.setSourceModel(model)
+        self.setSortRole(PRECEDENCE_ROLE)
+        self.setDynamicSortFilter(True)
+        self.sort(0)
 
-    def __lt__(self, other):
-        return self.precedence < other.precedence
+    def filterAcceptsRow(self, source_row, source_parent):  # pylint: disable=invalid-name,unused-argument
+        '''
+        Accepts the rows whose selection flag matches this view.
+        '''
+        model = self.sourceModel()
+        if bool(model.selected[source_row]) != self.selected:
+            return False
+        return self.visible is None or \
+            model.records[source_row].ribbon_id in self.visible
 
-    def __repr__(self):
-        typestr = "RibbonListWidgetItem"
-        return typestr + "(" + self.text() + "," + str(self.precedence) + ")"
+    def set_visible(self, ribbon_ids):
+        '''
+        Limits the view to the given ribbon IDs; None shows every ribbon.
+        '''
+        self.visible = None if ribbon_ids is None else set(ribbon_ids)
+        self.invalidateFilter()
 
 
-class RibbonListWidget(QListWidget):
+class RibbonListView(QListView):
     '''
-    Subclass of QListWidget to support out-of-focus event handling and emission
-    of removed ribbon through PyQt signals.
+    Subclass of QListView to support out-of-focus event handling, emission
+    of activated ribbons' IDs through PyQt signals, and prefetching the
+    thumbnails of the next page while scrolling.
     '''
-    removed_ribbon = pyqtSignal(RibbonListWidgetItem)
+    ribbon_activated = pyqtSignal(int)
 
-    def focusOutEvent(self, event):  # pylint: disable=invalid-name
+    def __init__(self, model):
+        super().__init__()
+        self.setModel(model)
+        self.setIconSize(THUMBNAIL_SIZE)
+        # every row is the same height, which lets Qt skip measuring rows
+        self.setUniformItemSizes(True)
+        self.doubleClicked.connect(self.on_double_clicked)
+        self.verticalScrollBar().valueChanged.connect(self.prefetch)
+
+    @pyqtSlot()
+    def prefetch(self):
         '''
-        Deselect the currently-selected item if the list loses focus
+        Requests thumbnails for the page of rows below the visible ones, so
+        they're ready by the time they scroll into view.
         '''
-        for item in self.selectedItems():
-            self.setCurrentItem(item, QItemSelectionModel.Deselect)
-        super(RibbonListWidget, self).focusOutEvent(event)
+        model = self.model()
+        first = self.indexAt(QPoint(0, 0)).row()
+        if first < 0:
+            return
+        last = self.indexAt(QPoint(0, self.viewport().height() - 1)).row()
+        if last < 0:
+            last = model.rowCount() - 1
+        stop = min(last + 1 + (last - first + 1), model.rowCount())
+        for row in range(last + 1, stop):
+            # asking for the icon is what starts loading it
+            model.index(row, 0).data(Qt.DecorationRole)
 
-    def remove_current_ribbon(self):
+    def focusOutEvent(self, event):  # pylint: disable=invalid-name
         '''
-        Removes currently selected ribbon from the list and emits it.
+        Deselect the currently-selected item if the list loses focus
         '''
-        ribbon = self.takeItem(self.currentRow())
-        self.removed_ribbon.emit(ribbon)
+        self.clearSelection()
+        super(RibbonListView, self).focusOutEvent(event)
 
-    @pyqtSlot(RibbonListWidgetItem)
-    def add_ribbon(self, ribbon):
+    @pyqtSlot(QModelIndex)
+    def on_double_clicked(self, index):
         '''
-        Slot to add a ribbon to the list.
+        Emits the ID of a double-clicked ribbon.
         '''
-        self.addItem(ribbon)
+        self.ribbon_activated.emit(index.data(ID_ROLE))
 
 
 class RibbonSelector(QWidget):
     '''
-    Allows the user to select the ribbons they want to display.
+    Allows the user to select the ribbons they want to display. Single
+    changes are announced through ribbon_added/ribbon_removed; bulk changes,
+    e.g. applying a profile, through one selection_replaced carrying every
+    selected ID.
     '''
-    ribbon_added = pyqtSignal(RibbonListWidgetItem)
-    ribbon_removed = pyqtSignal(RibbonListWidgetItem)
+    ribbon_added = pyqtSignal(int)
+    ribbon_removed = pyqtSignal(int)
+    selection_replaced = pyqtSignal(list)
 
-    def __init__(self, ribbons):
+    def __init__(self, catalog):
         super().__init__()
-        # initialize the lists
-        self.masterlist = RibbonListWidget()
-        self.currentlist = RibbonListWidget()
-        self.init_lists(ribbons)
+        # initialize the model and its two views
+        self.model = RibbonModel(catalog)
+        self.search_index = RibbonSearchIndex(catalog)
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search ribbons")
+        self.search_box.setClearButtonEnabled(True)
+        self.masterlist = RibbonListView(RibbonFilterModel(self.model, False))
+        self.currentlist = RibbonListView(RibbonFilterModel(self.model, True))
         # add components to layout
         self.layout = QHBoxLayout(self)
         self.setLayout(self.layout)
@@ -90,47 +313,69 @@ class RibbonSelector(QWidget):
         '''
         Helper function to manage all widget placement
         '''
-        self.layout.addWidget(self.masterlist)
+        master_layout = QVBoxLayout()
+        master_layout.addWidget(self.search_box)
+        master_layout.addWidget(self.masterlist)
+        self.layout.addLayout(master_layout)
         self.layout.addWidget(self.currentlist)
 
-    def init_lists(self, ribbons):
+    def add_master_ribbon(self, record):
         '''
-        Enable sorting on both lists and then initialize the masterlist with
-        all values from ribbon set.
+        Adds a single ribbon to the masterlist, e.g. while ribbons are still
+        being scraped. Ribbons already in either list are ignored.
         '''
-        self.masterlist.setSortingEnabled(True)
-        self.currentlist.setSortingEnabled(True)
-        for precedence, ribbon in ribbons.items():
-            self.masterlist.addItem(RibbonListWidgetItem(ribbon, precedence))
+        if record.ribbon_id not in self.model.rows:
+            self.search_index.add(record)
+            self.model.append(record)
+            if self.search_box.text():
+                self.search(self.search_box.text())
 
     def connect_ui(self):
         '''
         Helper function to manage all connections of UI elements
         '''
-        # RibbonSelector
-        self.masterlist.removed_ribbon.connect(self.on_ribbon_added)
-        self.currentlist.removed_ribbon.connect(self.on_ribbon_removed)
-        # masterlist
-        self.masterlist.itemDoubleClicked.connect(
-            self.masterlist.remove_current_ribbon)
-        self.masterlist.removed_ribbon.connect(
-            self.currentlist.add_ribbon)
-        # currentlist
-        self.currentlist.itemDoubleClicked.connect(
-            self.currentlist.remove_current_ribbon)
-        self.currentlist.removed_ribbon.connect(
-            self.masterlist.add_ribbon)
+        self.masterlist.ribbon_activated.connect(self.select_ribbon)
+        self.currentlist.ribbon_activated.connect(self.deselect_ribbon)
+        self.search_box.textChanged.connect(self.search)
+
+    @pyqtSlot(str)
+    def search(self, query):
+        '''
+        Filters the masterlist down to ribbons matching the search query.
+        '''
+        self.masterlist.model().set_visible(self.search_index.search(query))
+
+    @pyqtSlot(int)
+    def select_ribbon(self, ribbon_id):
+        '''
+        Moves a ribbon to the currentlist and forwards it externally
+        '''
+        if self.model.set_selected(ribbon_id, True):
+            self.ribbon_added.emit(ribbon_id)
+
+    @pyqtSlot(int)
+    def deselect_ribbon(self, ribbon_id):
+        '''
+        Moves a ribbon back to the masterlist and forwards it externally
+        '''
+        if self.model.set_selected(ribbon_id, False):
+            self.ribbon_removed.emit(ribbon_id)
 
-    @pyqtSlot(RibbonListWidgetItem)
-    def on_ribbon_added(self, ribbon):
+    def reload(self, catalog, changed_ids=()):
         '''
-        Forwards signal externally
+        Brings both lists in line with a rebuilt catalog without changing
+        the selection, and refreshes the icons of ribbons whose images
+        changed (changed_ids).
         '''
-        self.ribbon_added.emit(ribbon)
+        self.model.update_records(catalog)
+        for ribbon_id in changed_ids:
+            self.model.on_thumbnail_ready(ribbon_id)
+        self.search_index = RibbonSearchIndex(catalog)
+        if self.search_box.text():
+            self.search(self.search_box.text())
 
-    @pyqtSlot(RibbonListWidgetItem)
-    def on_ribbon_removed(self, ribbon):
+    def set_selection(self, ribbon_ids):
         '''
-        Forwards signal externally
+        Replaces the whole selection at once and forwards it externally
         '''
-        self.ribbon_removed.emit(ribbon)
+        self.selection_replaced.emit(self.model.set_selection(ribbon_ids))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+'''
+HTTP service rendering racks on demand, e.g. for a personnel portal. Racks
+are rendered by RackCompositor in a pool of worker processes, each of which
+loads precedence and images once, and responses are cached and given ETags
+keyed by the canonical ribbon set, so repeat requests cost no rendering.
+
+Usage: python ribbonserver.py [--port 8080] [--workers N]
+       (or: python ribbonrack.py serve ...)
+
+Request: GET /rack/<branch>?ribbon=<name or ID>&ribbon=...[&scale=1.0]
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import signal
+import sys
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from ribboncompositor import (
+    init_worker,
+    render_in_worker,
+    UnknownRibbonError
+)
+from ribbons import Ribbons, scale_bucket
+
+# the zoom range of the GUI
+MIN_SCALE = 0.25
+MAX_SCALE = 4.0
+
+
+def ping():
+    '''
+    Does nothing in a worker process; used to start the workers early.
+    '''
+
+
+class RackService():
+    '''
+    Canonicalizes rack requests and hands them to the worker pool. Finished
+    PNGs are kept in an LRU cache of cache_size entries, and identical
+    requests arriving while a rack is being rendered share its render.
+    '''
+    def __init__(self, workers=None, cache_size=4096):
+        self.ribbons = Ribbons()
+        self.ribbons.load_precedence()
+        self.ribbons.precedence.load_all()
+        # workers load the data once, so a rescrape is only served (and old
+        # ETags invalidated) once the service is restarted
+        self.version = str(os.stat(str(self.ribbons.store_location))
+                           .st_mtime_ns)
+        self.cache_size = cache_size
+        self.responses = collections.OrderedDict()
+        self.pending = dict()
+        self.lock = threading.Lock()
+        workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=init_worker)
+        # start every worker now rather than on the first requests
+        for future in [self.pool.submit(ping) for _ in range(workers)]:
+            future.result()
+
+    def canonicalize(self, branch, ribbons, scale):
+        '''
+        Returns the cache key for a request: the branch, the sorted IDs of
+        the requested ribbons (given by name or ID) and the scale, snapped
+        to the compositor's steps. Raises UnknownRibbonError for unknown
+        branches or ribbons.
+        '''
+        if branch not in self.ribbons.precedence:
+            raise UnknownRibbonError(branch, ribbons)
+        catalog = self.ribbons.catalog(branch)
+        ribbon_ids = set()
+        unknown = []
+        for ribbon in ribbons:
+            if ribbon.isdigit() and int(ribbon) in catalog:
+                ribbon_ids.add(int(ribbon))
+            elif ribbon in catalog.by_name:
+                ribbon_ids.add(catalog.by_name[ribbon].ribbon_id)
+            else:
+                unknown.append(ribbon)
+        if unknown:
+            raise UnknownRibbonError(branch, unknown)
+        return (branch, tuple(sorted(ribbon_ids)), scale_bucket(scale))
+
+    def etag(self, key):
+        '''
+        Returns the ETag of a rack.
+        '''
+        digest = hashlib.sha1((self.version + repr(key)).encode('utf-8'))
+        return '"' + digest.hexdigest() + '"'
+
+    def render(self, key):
+        '''
+        Returns a rack's PNG, from the cache if possible.
+        '''
+        with self.lock:
+            png = self.responses.get(key)
+            if png is not None:
+                self.responses.move_to_end(key)
+                return png
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pool.submit(render_in_worker, *key)
+                self.pending[key] = future
+        try:
+            png = future.result()
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+        with self.lock:
+            self.responses[key] = png
+            if len(self.responses) > self.cache_size:
+                self.responses.popitem(last=False)
+        return png
+
+    def shutdown(self):
+        '''
+        Stops the worker processes.
+        '''
+        self.pool.shutdown()
+
+
+class RackRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serves GET /rack/<branch>. The RackService is the server's service
+    attribute.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''
+        Parses a rack request and responds with its PNG, a 304 if the client
+        already has it, or an error.
+        '''
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'rack':
+            self.send_text(HTTPStatus.NOT_FOUND, "Use /rack/<branch>")
+            return
+        query = parse_qs(url.query)
+        ribbons = query.get('ribbon', [])
+        if not ribbons:
+            self.send_text(HTTPStatus.BAD_REQUEST, "No ribbons requested")
+            return
+        try:
+            scale = float(query.get('scale', ['1'])[0])
+        except ValueError:
+            self.send_text(HTTPStatus.BAD_REQUEST, "Scale must be a number")
+            return
+        if not MIN_SCALE <= scale <= MAX_SCALE:
+            self.send_text(HTTPStatus.BAD_REQUEST, "Scale must be between " +
+                           str(MIN_SCALE) + " and " + str(MAX_SCALE))
+            return
+        service = self.server.service
+        try:
+            key = service.canonicalize(unquote(parts[1]), ribbons, scale)
+        except UnknownRibbonError as error:
+            self.send_text(HTTPStatus.NOT_FOUND, error.args[0])
+            return
+        etag = service.etag(key)
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        try:
+            png = service.render(key)
+        except Exception as error:  # pylint: disable=broad-except
+            # e.g. a ribbon image missing from the data folder
+            print("Rendering " + repr(key) + " failed: " + repr(error),
+                  file=sys.stderr)
+            self.send_text(HTTPStatus.INTERNAL_SERVER_ERROR,
+                           "The rack couldn't be rendered")
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(png)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        self.end_headers()
+        self.wfile.write(png)
+
+    def send_text(self, status, message):
+        '''
+        Responds with a plain text message.
+        '''
+        body = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''
+        Only logs when asked to with --verbose.
+        '''
+        if self.server.verbose:
+            super(RackRequestHandler, self).log_message(format, *args)
+
+
+class RackServer(ThreadingHTTPServer):
+    '''
+    Threading HTTP server with a listen backlog deep enough for many
+    concurrent clients; the default of 5 makes connections beyond it wait
+    for a SYN retransmit.
+    '''
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def main(argv=None):
+    '''
+    Runs the service until interrupted.
+    '''
+    parser = argparse.ArgumentParser(description="Serve rendered racks.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--cache-size', type=int, default=4096,
+                        help="number of rendered racks to keep")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    server = RackServer((args.host, args.port), RackRequestHandler)
+    server.service = RackService(args.workers, args.cache_size)
+    server.verbose = args.verbose
+    # stop cleanly, including the worker processes, when terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    print("Serving racks on http://" + args.host + ":" +
+          str(server.server_address[1]) + "/rack/<branch>", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
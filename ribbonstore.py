@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+'''
+Versioned binary storage for ribbon precedence. Each branch is stored as its
+ribbon names in order of precedence, so loading needs no key conversion, and
+a table of contents lets a branch be read only when it's first needed.
+
+File layout (little-endian): magic, schema version and branch count, then per
+branch the length of its name, the offset and length of its section, and its
+name. Each section is the branch's ribbon names joined by newlines.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+from pathlib import Path
+import struct
+
+from ribbonfiles import atomic_write
+from ribbontrace import span
+
+STORE_MAGIC = b'RRPS'
+SCHEMA_VERSION = 1
+HEADER = struct.Struct('<4sHH')
+ENTRY = struct.Struct('<HQQ')
+
+
+class StoreError(ValueError):
+    '''
+    Raised when a store file can't be read, so precedence has to come from
+    elsewhere.
+    '''
+
+
+class SchemaVersionError(StoreError):
+    '''
+    Raised when a store file isn't in the schema version this code reads.
+    '''
+
+
+class CorruptStoreError(StoreError):
+    '''
+    Raised when a store file is truncated or otherwise damaged.
+    '''
+
+
+class PrecedenceStore():
+    '''
+    Read-only view of a precedence store file. The file is read whole when
+    opened, so branches read later still come from the same version of the
+    file even if it has since been replaced. No handle or mapping is kept
+    open, since Windows won't replace a file that's mapped.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.sections = dict()
+        self.data = self.path.read_bytes()
+        if len(self.data) < HEADER.size:
+            raise CorruptStoreError(str(self.path) + " is truncated")
+        magic, version, count = HEADER.unpack_from(self.data, 0)
+        if magic != STORE_MAGIC:
+            raise SchemaVersionError(str(self.path) +
+                                     " is not a precedence store")
+        if version != SCHEMA_VERSION:
+            raise SchemaVersionError(
+                str(self.path) + " has schema version " + str(version) +
+                ", expected " + str(SCHEMA_VERSION))
+        try:
+            self.read_contents(count)
+        except (struct.error, UnicodeDecodeError) as error:
+            raise CorruptStoreError(str(self.path) + " is damaged: " +
+                                    str(error))
+
+    def read_contents(self, count):
+        '''
+        Reads the table of contents, checking that every section lies
+        within the file.
+        '''
+        position = HEADER.size
+        for _ in range(count):
+            name_length, offset, length = ENTRY.unpack_from(
+                self.data, position)
+            position += ENTRY.size
+            if position + name_length > len(self.data) or \
+                    offset + length > len(self.data):
+                raise struct.error("section out of bounds")
+            branch = self.data[position:position + name_length].decode(
+                'utf-8')
+            position += name_length
+            self.sections[branch] = (offset, length)
+
+    def __contains__(self, branch):
+        return branch in self.sections
+
+    def branches(self):
+        '''
+        Returns the names of all stored branches.
+        '''
+        return set(self.sections)
+
+    def load(self, branch):
+        '''
+        Reads one branch as {precedence: ribbon name}.
+        '''
+        offset, length = self.sections[branch]
+        if not length:
+            return dict()
+        try:
+            names = self.data[offset:offset + length].decode('utf-8')
+        except UnicodeDecodeError as error:
+            raise CorruptStoreError(str(self.path) + " is damaged: " +
+                                    str(error))
+        return dict(enumerate(names.split('\n')))
+
+    @staticmethod
+    def write(path, precedence):
+        '''
+        Writes {branch: {precedence: ribbon name}} to path atomically, and
+        flushed to disk before it replaces the old file.
+        '''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        sections = []
+        for branch in sorted(precedence):
+            ribbons = precedence[branch]
+            names = [ribbons[rank] for rank in sorted(ribbons)]
+            sections.append((branch.encode('utf-8'),
+                             '\n'.join(names).encode('utf-8')))
+        offset = HEADER.size + sum(ENTRY.size + len(branch)
+                                   for branch, _ in sections)
+        contents = [HEADER.pack(STORE_MAGIC, SCHEMA_VERSION, len(sections))]
+        for branch, section in sections:
+            contents.append(ENTRY.pack(len(branch), offset, len(section)))
+            contents.append(branch)
+            offset += len(section)
+        contents.extend(section for _, section in sections)
+        atomic_write(path, b''.join(contents), durable=True)
+
+
+class LazyPrecedence(dict):
+    '''
+    {branch: {precedence: ribbon name}} that reads each branch from a
+    PrecedenceStore the first time it's accessed. Branches missing from the
+    store start out empty, like the defaultdict this replaces.
+    '''
+    def __init__(self, store=None):
+        super().__init__()
+        self.store = store
+
+    def __missing__(self, branch):
+        if self.store is not None and branch in self.store:
+            with span('precedence.load_branch', branch=branch):
+                ribbons = self.store.load(branch)
+        else:
+            ribbons = dict()
+        self[branch] = ribbons
+        return ribbons
+
+    def load_all(self):
+        '''
+        Reads every stored branch that hasn't been accessed yet.
+        '''
+        if self.store is not None:
+            for branch in self.store.branches():
+                self[branch]  # pylint: disable=pointless-statement
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''
+Opt-in tracing for field diagnostics. Hot paths are wrapped in spans and
+counters, which do nothing unless switched on through the environment
+before the application starts:
+
+    RIBBONRACK_TRACE=trace.json     write every span and counter as a Chrome
+                                    trace (open in chrome://tracing or
+                                    Perfetto) when the process exits
+    RIBBONRACK_PROFILE=run.prof     profile the main thread with cProfile
+                                    and dump the stats when the process
+                                    exits (read with pstats or snakeviz)
+
+When tracing is off, span() returns a shared do-nothing context manager and
+count() is a function that returns immediately, so instrumentation can be
+left in place.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+
+from ribbonfiles import atomic_write
+
+TRACE_PATH = os.environ.get('RIBBONRACK_TRACE')
+PROFILE_PATH = os.environ.get('RIBBONRACK_PROFILE')
+ENABLED = bool(TRACE_PATH)
+
+
+class NullSpan():
+    '''
+    Context manager standing in for a span while tracing is off.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span():
+    '''
+    Records the wall time of a with block as a complete trace event.
+    '''
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        end = time.perf_counter()
+        TRACER.add(dict(name=self.name, ph='X', ts=self.start * 1e6,
+                        dur=(end - self.start) * 1e6, pid=os.getpid(),
+                        tid=threading.get_ident(), args=self.args))
+        return False
+
+
+class Tracer():
+    '''
+    Collects trace events and counter totals, and writes them out as a
+    Chrome trace when the process exits.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.events = list()
+        self.counters = dict()
+        self.lock = threading.Lock()
+
+    def add(self, event):
+        '''
+        Records a trace event.
+        '''
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name, amount):
+        '''
+        Adds to a counter, recording its new total as a counter event.
+        '''
+        with self.lock:
+            total = self.counters.get(name, 0) + amount
+            self.counters[name] = total
+            self.events.append(dict(name=name, ph='C',
+                                    ts=time.perf_counter() * 1e6,
+                                    pid=os.getpid(), args=dict(value=total)))
+
+    def write(self):
+        '''
+        Writes the trace atomically.
+        '''
+        with self.lock:
+            trace = dict(traceEvents=self.events, displayTimeUnit='ms',
+                         otherData=dict(counters=self.counters))
+            data = json.dumps(trace).encode('utf-8')
+        atomic_write(self.path, data)
+        print("Trace written to " + self.path)
+
+
+if ENABLED:
+    TRACER = Tracer(TRACE_PATH)
+    atexit.register(TRACER.write)
+
+    def span(name, **args):
+        '''
+        Returns a context manager timing its with block as name. Keyword
+        arguments are attached to the event.
+        '''
+        return Span(name, args)
+
+    def count(name, amount=1):
+        '''
+        Adds amount to the counter name.
+        '''
+        TRACER.count(name, amount)
+else:
+    TRACER = None
+
+    def span(name, **args):  # pylint: disable=unused-argument
+        '''
+        Tracing is off; returns a context manager that does nothing.
+        '''
+        return NULL_SPAN
+
+    def count(name, amount=1):  # pylint: disable=unused-argument
+        '''
+        Tracing is off; does nothing.
+        '''
+
+if PROFILE_PATH:
+    PROFILER = cProfile.Profile()
+    PROFILER.enable()
+    atexit.register(PROFILER.dump_stats, PROFILE_PATH)
+    atexit.register(PROFILER.disable)
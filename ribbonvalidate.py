@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+'''
+Checks submitted racks against precedence in bulk. Each claimed rack lists
+its ribbons (by name or ID) from highest precedence to lowest; every rack is
+checked for unknown ribbons, ribbons listed more than once and pairs of
+ribbons in the wrong order, and the corrected order is worked out.
+
+All racks are checked together: names are mapped to precedence ranks with a
+precomputed lookup into one flat NumPy array, and the comparisons and sort
+run over that array in a single pass rather than rack by rack. Only racks
+found to be out of order have every pair compared.
+
+Usage: python ribbonvalidate.py ROSTER [--all] [-o report.jsonl]
+       (ROSTER is a CSV or JSON Lines file, as for ribbonbatch.py)
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+import argparse
+import json
+import sys
+import time
+
+import numpy
+
+from ribbonbatch import read_roster
+from ribboncatalog import ribbon_id
+from ribbons import Ribbons
+
+UNKNOWN = -1
+
+
+class RackReport():
+    '''
+    Result of checking one claimed rack. duplicates holds every repeated
+    listing of a ribbon after its first (by name or ID), out_of_order every
+    (higher, lower) pair whose lower-precedence ribbon was listed first, and
+    corrected the known ribbons in precedence order, each once.
+    '''
+    __slots__ = ('record_id', 'branch', 'unknown', 'duplicates',
+                 'out_of_order', 'corrected')
+
+    def __init__(self, record_id, branch, unknown, duplicates, out_of_order,
+                 corrected):
+        self.record_id = record_id
+        self.branch = branch
+        self.unknown = unknown
+        self.duplicates = duplicates
+        self.out_of_order = out_of_order
+        self.corrected = corrected
+
+    @property
+    def valid(self):
+        '''
+        Whether the rack has no unknown or repeated ribbons and is in order.
+        '''
+        return (not self.unknown and not self.duplicates and
+                not self.out_of_order)
+
+    def as_dict(self):
+        '''
+        The report as a JSON-serializable dictionary.
+        '''
+        return dict(record_id=self.record_id, branch=self.branch,
+                    valid=self.valid, unknown=self.unknown,
+                    duplicates=self.duplicates, out_of_order=self.out_of_order,
+                    corrected=self.corrected)
+
+
+class RackValidator():
+    '''
+    Validates claimed racks against the precedence in a Ribbons object. The
+    per-branch rank lookups are built once and reused for every batch.
+    '''
+    def __init__(self, ribbons):
+        self.ribbons = ribbons
+        self.ribbons.precedence.load_all()
+        self.lookups = dict()
+
+    def lookup(self, branch):
+        '''
+        Returns {ribbon name or ID: rank} for a branch; empty for unknown
+        branches, so all of their ribbons are unknown.
+        '''
+        if branch not in self.lookups:
+            lookup = dict()
+            for rank, name in self.ribbons.precedence.get(branch,
+                                                          dict()).items():
+                lookup[name] = rank
+                lookup[ribbon_id(branch, name)] = rank
+            self.lookups[branch] = lookup
+        return self.lookups[branch]
+
+    def validate(self, racks):
+        '''
+        Checks (record ID, branch, [ribbon name or ID]) racks, returning a
+        RackReport per rack in the same order.
+        '''
+        racks = list(racks)
+        lengths = numpy.fromiter((len(names) for _, _, names in racks),
+                                 dtype=numpy.int64, count=len(racks))
+        flat_names = [name for _, _, names in racks for name in names]
+        ranks = numpy.fromiter(
+            (lookup.get(name, UNKNOWN)
+             for _, branch, names in racks
+             for lookup in (self.lookup(branch),)
+             for name in names),
+            dtype=numpy.int64, count=len(flat_names))
+        rack_of = numpy.repeat(numpy.arange(len(racks)), lengths)
+
+        # unknown ribbons are left out of the order checks and corrections
+        unknown = numpy.flatnonzero(ranks == UNKNOWN)
+        known = numpy.flatnonzero(ranks != UNKNOWN)
+        known_ranks = ranks[known]
+        known_racks = rack_of[known]
+        known_ends = numpy.cumsum(
+            numpy.bincount(known_racks, minlength=len(racks)))
+        # a rack with any pair out of order has an adjacent pair out of
+        # order, so this finds every rack whose pairs need comparing
+        inverted = numpy.flatnonzero(
+            (known_ranks[:-1] > known_ranks[1:]) &
+            (known_racks[:-1] == known_racks[1:]))
+        # the sort is stable, so a repeated ribbon follows its first listing
+        order = numpy.lexsort((known_ranks, known_racks))
+        sorted_ranks = known_ranks[order]
+        sorted_racks = known_racks[order]
+        repeated = numpy.zeros(len(order), dtype=bool)
+        repeated[1:] = ((sorted_ranks[1:] == sorted_ranks[:-1]) &
+                        (sorted_racks[1:] == sorted_racks[:-1]))
+        duplicates = numpy.sort(known[order[repeated]])
+        corrected = known[order[~repeated]]
+        corrected_ends = numpy.cumsum(numpy.bincount(
+            known_racks[order[~repeated]], minlength=len(racks)))
+
+        # only racks with problems need more than their claimed order
+        problems = numpy.zeros(len(racks), dtype=bool)
+        problems[rack_of[unknown]] = True
+        problems[rack_of[duplicates]] = True
+        problems[known_racks[inverted]] = True
+        unknown_by_rack = dict()
+        for position in unknown.tolist():
+            unknown_by_rack.setdefault(int(rack_of[position]), []).append(
+                flat_names[position])
+        duplicates_by_rack = dict()
+        for position in duplicates.tolist():
+            duplicates_by_rack.setdefault(int(rack_of[position]), []).append(
+                flat_names[position])
+        # every known ribbon of an out-of-order rack is paired with each one
+        # listed after it in the same rack, and the inverted pairs kept
+        unordered = numpy.zeros(len(racks), dtype=bool)
+        unordered[known_racks[inverted]] = True
+        candidates = numpy.flatnonzero(unordered[known_racks])
+        later = known_ends[known_racks[candidates]] - candidates - 1
+        firsts = numpy.repeat(candidates, later)
+        seconds = firsts + 1 + numpy.arange(len(firsts)) - numpy.repeat(
+            numpy.cumsum(later) - later, later)
+        out_of_order = known_ranks[firsts] > known_ranks[seconds]
+        inverted_by_rack = dict()
+        for first, second in zip(known[firsts[out_of_order]].tolist(),
+                                 known[seconds[out_of_order]].tolist()):
+            inverted_by_rack.setdefault(int(rack_of[first]), []).append(
+                (flat_names[second], flat_names[first]))
+
+        reports = []
+        for index, (record_id, branch, names) in enumerate(racks):
+            if problems[index]:
+                start = corrected_ends[index - 1] if index else 0
+                rack_order = corrected[start:corrected_ends[index]].tolist()
+                reports.append(RackReport(
+                    record_id, branch, unknown_by_rack.get(index, []),
+                    duplicates_by_rack.get(index, []),
+                    inverted_by_rack.get(index, []),
+                    [flat_names[position] for position in rack_order]))
+            else:
+                reports.append(RackReport(record_id, branch, [], [], [],
+                                          list(names)))
+        return reports
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Validate claimed racks.")
+    PARSER.add_argument('roster', help="CSV or JSON Lines roster")
+    PARSER.add_argument('--all', action='store_true',
+                        help="report valid racks too")
+    PARSER.add_argument('-o', '--output', help="write reports here, not "
+                        "to standard output")
+    ARGS = PARSER.parse_args()
+    RIBBONS = Ribbons()
+    RIBBONS.load_precedence()
+    START = time.perf_counter()
+    REPORTS = RackValidator(RIBBONS).validate(read_roster(ARGS.roster))
+    ELAPSED = time.perf_counter() - START
+    INVALID = sum(not report.valid for report in REPORTS)
+    OUTPUT = open(ARGS.output, 'w') if ARGS.output else sys.stdout
+    for REPORT in REPORTS:
+        if ARGS.all or not REPORT.valid:
+            OUTPUT.write(json.dumps(REPORT.as_dict()) + '\n')
+    if OUTPUT is not sys.stdout:
+        OUTPUT.close()
+    print("Checked {} racks in {:.2f} s: {} invalid".format(
+        len(REPORTS), ELAPSED, INVALID), file=sys.stderr)
+    sys.exit(1 if INVALID else 0)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+'''
+Watches the stored ribbon data, so changes made while the application runs
+(a rescrape from another process, an edited precedence.json, refreshed
+images) are picked up without restarting.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+from PyQt5.QtCore import (
+    pyqtSignal,
+    pyqtSlot,
+    QFileSystemWatcher,
+    QObject,
+    QTimer
+)
+
+from ribbonatlas import atlas_path
+
+
+def signature(path):
+    '''
+    (modification time, size) of a file, or None if it doesn't exist.
+    '''
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class RibbonWatcher(QObject):
+    '''
+    Reports changes to the precedence store, precedence.json and each
+    branch's images. File system events are debounced: every event restarts
+    a timer, and only once it runs out (delay milliseconds after the last
+    event) are the files compared with what was last seen, so a burst of
+    writes, e.g. a whole rescrape, is reported once.
+
+    Files replaced by an atomic rename stop being watched, so every watched
+    path that exists is (re-)added on each check.
+    '''
+    precedence_changed = pyqtSignal()
+    json_changed = pyqtSignal()
+    # branch, and the filenames (without extension) of its changed images
+    images_changed = pyqtSignal(str, list)
+
+    def __init__(self, ribbons, delay=500):
+        super().__init__()
+        self.ribbons = ribbons
+        self.watcher = QFileSystemWatcher(self)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.signatures = dict()
+        self.images = dict()
+        for path in self.files():
+            self.signatures[path] = signature(path)
+        for branch in self.ribbons.branches:
+            self.images[branch] = self.scan(branch)
+        self.watch()
+        self.watcher.fileChanged.connect(self.timer.start)
+        self.watcher.directoryChanged.connect(self.timer.start)
+        self.timer.timeout.connect(self.check)
+
+    def files(self):
+        '''
+        The individually watched files.
+        '''
+        files = [self.ribbons.store_location, self.ribbons.info_location]
+        for branch in sorted(self.ribbons.branches):
+            files.append(atlas_path(self.ribbons.image_location, branch))
+        return files
+
+    def folders(self):
+        '''
+        The watched folders, whose events cover files being created,
+        replaced or deleted.
+        '''
+        folders = [self.ribbons.info_location.parent,
+                   self.ribbons.image_location]
+        for branch in sorted(self.ribbons.branches):
+            folders.append(self.ribbons.image_location.joinpath(branch))
+        return folders
+
+    def watch(self):
+        '''
+        Watches every watched path that currently exists.
+        '''
+        watched = set(self.watcher.files() + self.watcher.directories())
+        paths = [str(path) for path in self.files() + self.folders()
+                 if path.exists() and str(path) not in watched]
+        if paths:
+            self.watcher.addPaths(paths)
+
+    def scan(self, branch):
+        '''
+        Returns {filename without extension: signature} for a branch's
+        images.
+        '''
+        folder = self.ribbons.image_location.joinpath(branch)
+        if not folder.is_dir():
+            return dict()
+        return {path.stem: signature(path) for path in folder.iterdir()
+                if path.is_file()}
+
+    @pyqtSlot()
+    def check(self):
+        '''
+        Compares the watched files with what was last seen and reports what
+        changed.
+        '''
+        self.watch()
+        changed = set()
+        for path in self.files():
+            current = signature(path)
+            if current != self.signatures.get(path):
+                self.signatures[path] = current
+                changed.add(path)
+        if self.ribbons.info_location in changed:
+            self.json_changed.emit()
+        if self.ribbons.store_location in changed:
+            self.precedence_changed.emit()
+        for branch in sorted(self.ribbons.branches):
+            old = self.images[branch]
+            new = self.scan(branch)
+            self.images[branch] = new
+            stems = sorted(stem for stem in set(old) | set(new)
+                           if old.get(stem) != new.get(stem))
+            atlas_changed = atlas_path(self.ribbons.image_location,
+                                       branch) in changed
+            if stems or atlas_changed:
+                self.images_changed.emit(branch, stems)
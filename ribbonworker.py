@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+'''
+Runs a RibbonScraper off the GUI thread, reporting each ribbon through PyQt
+signals as soon as it's scraped so the UI can fill in while scraping
+continues.
+
+Author: Alden Davidson, adavidson@protonmail.ch
+Date: Summer 2019
+'''
+
+from PyQt5.QtCore import (
+    pyqtSignal,
+    pyqtSlot,
+    QObject
+)
+
+from ribbonscraper import ScrapeCancelled
+
+
+class ScrapeWorker(QObject):
+    '''
+    Worker object to be moved onto a QThread. Emits ribbon_scraped for every
+    ribbon, progress after every ribbon, and exactly one of finished, failed
+    or cancelled when done.
+    '''
+    ribbon_scraped = pyqtSignal(str, int, str)
+    progress = pyqtSignal(str, int, int)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, scraper, ribbons, branch="all"):
+        super().__init__()
+        self.scraper = scraper
+        self.ribbons = ribbons
+        self.branch = branch
+
+    @pyqtSlot()
+    def run(self):
+        '''
+        Scrapes the requested branches. Connect to QThread.started.
+        '''
+        try:
+            self.scraper.scrape(self.ribbons, self.branch,
+                                on_ribbon=self.on_ribbon)
+        except ScrapeCancelled:
+            self.cancelled.emit()
+        except Exception as error:  # pylint: disable=broad-except
+            # network, parsing and disk errors all end the scrape the same way
+            self.failed.emit(str(error))
+        else:
+            self.finished.emit()
+
+    def on_ribbon(self, branch, precedence, name, total):
+        '''
+        Scraper callback; forwards the ribbon and progress as signals.
+        '''
+        self.ribbon_scraped.emit(branch, precedence, name)
+        self.progress.emit(branch, precedence + 1, total)
+
+    def cancel(self):
+        '''
+        Asks the scraper to stop. Called directly from the GUI thread, since
+        this object's own thread is busy running the scrape.
+        '''
+        self.scraper.cancel()